@@ -4,16 +4,79 @@ Args: event - HTTP запрос с методом POST/GET, body содержи
       context - контекст выполнения с request_id
 Returns: HTTP ответ с токеном сессии или ошибкой
 """
+import asyncio
+import base64
+import gzip
 import json
+import math
 import os
+import random
+import time
 import hashlib
 import secrets
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Sequence, Tuple, Callable, Coroutine
 import psycopg2
 import psycopg2.extras
+import asyncpg
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '10'))
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', '3'))
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', '5000'))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_SECONDS = int(os.environ.get('CIRCUIT_RESET_SECONDS', '30'))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '1'))
+MAX_IN_FLIGHT_REQUESTS = int(os.environ.get('MAX_IN_FLIGHT_REQUESTS', '500'))
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESSION_MIN_BYTES', '1024'))
+RESPONSE_GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', '6'))
+RESPONSE_BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', '5'))
+RESPONSE_ZSTD_LEVEL = int(os.environ.get('RESPONSE_ZSTD_LEVEL', '3'))
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '5'))
+REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('REPLICA_LAG_CHECK_INTERVAL', '10'))
+SESSION_REPLICA_READS = os.environ.get('SESSION_REPLICA_READS', '0') == '1'
+
+STATEMENT_TIMEOUTS_MS = {
+    'verify': 1000,
+    'logout': 1000,
+    'login': 2000,
+}
+
+ASYNC_DB_FAILURES = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.exceptions.QueryCanceledError,
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.InsufficientResourcesError,
+    asyncpg.exceptions.OperatorInterventionError,
+    asyncpg.exceptions.InterfaceError,
+)
+
+REPLICA_LAG_EXPRESSION = "CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+REPLICA_LAG_QUERY = f"SELECT {REPLICA_LAG_EXPRESSION} AS lag"
+SESSION_QUERY = "SELECT s.user_id, u.email, u.full_name, u.role FROM sessions s JOIN users u ON s.user_id = u.id WHERE s.token = %s AND s.expires_at > CURRENT_TIMESTAMP"
+# На реплике сессия видна, только пока отставание не больше REPLICA_MAX_LAG_SECONDS (на primary выражение равно 0)
+REPLICA_SESSION_QUERY = f"{SESSION_QUERY} AND {REPLICA_LAG_EXPRESSION} <= %s::float8"
+
+COMPRESSORS: Dict[str, Callable[[bytes], bytes]] = {}
+try:
+    import brotli
+    COMPRESSORS['br'] = lambda data: brotli.compress(data, quality=RESPONSE_BROTLI_QUALITY)
+except ImportError:
+    pass
+try:
+    import zstandard
+    COMPRESSORS['zstd'] = lambda data: zstandard.ZstdCompressor(level=RESPONSE_ZSTD_LEVEL).compress(data)
+except ImportError:
+    pass
+COMPRESSORS['gzip'] = lambda data: gzip.compress(data, compresslevel=RESPONSE_GZIP_LEVEL)
+
+_pools: Dict[str, asyncpg.Pool] = {}
+_pool_lock = asyncio.Lock()
+_circuit = {'failures': 0, 'open_until': 0.0}
+_in_flight = 0
+_replica_lag: Dict[str, Tuple[float, float]] = {}
 
 def hash_password(password: str) -> str:
     """Простое хеширование пароля (в продакшене использовать bcrypt)"""
@@ -23,53 +86,343 @@ def verify_password(password: str, password_hash: str) -> bool:
     """Проверка пароля"""
     return hash_password(password) == password_hash
 
-def escape_sql_string(value: str) -> str:
-    """Экранирование строки для SQL"""
-    return value.replace("'", "''")
+def json_response(status_code: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Формирование JSON ответа"""
+    return {
+        'statusCode': status_code,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **(headers or {})},
+        'body': json.dumps(payload),
+        'isBase64Encoded': False
+    }
+
+def to_asyncpg_query(query: str) -> str:
+    """Замена плейсхолдеров %s (psycopg2) на $1, $2, ... (asyncpg)"""
+    parts = query.split('%s')
+    return parts[0] + ''.join(f'${i}{part}' for i, part in enumerate(parts[1:], 1))
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Выбор сжатия по Accept-Encoding с учетом q-значений (в порядке предпочтения сервера)"""
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in COMPRESSORS:
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+def compress_response(response: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+    """Сжатие тела ответа больше RESPONSE_COMPRESSION_MIN_BYTES; сжатое тело передается в base64"""
+    body = response.get('body')
+    if not isinstance(body, str) or response.get('isBase64Encoded'):
+        return response
+    raw = body.encode('utf-8')
+    if len(raw) < RESPONSE_COMPRESSION_MIN_BYTES:
+        return response
+
+    headers = {**response.get('headers', {}), 'Vary': 'Accept-Encoding'}
+    request_headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    encoding = negotiate_encoding(request_headers.get('accept-encoding', ''))
+    compressed = COMPRESSORS[encoding](raw) if encoding else None
+    if compressed is None or len(compressed) >= len(raw):
+        return {**response, 'headers': headers}
+
+    headers['Content-Encoding'] = encoding
+    return {
+        **response,
+        'headers': headers,
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+def unavailable_response(retry_after: int) -> Dict[str, Any]:
+    """Ответ 503 при недоступной или перегруженной БД"""
+    return json_response(
+        503,
+        {'error': 'Сервис временно недоступен, повторите запрос позже'},
+        {'Retry-After': str(retry_after)}
+    )
+
+class ServiceUnavailable(Exception):
+    """БД недоступна или не уложилась в таймаут: запрос завершается ответом 503"""
+
+    def __init__(self, retry_after: int):
+        super().__init__('База данных недоступна')
+        self.retry_after = retry_after
+
+def circuit_check():
+    """Быстрый отказ, пока автомат разомкнут; по истечении паузы пропускается один пробный запрос"""
+    if _circuit['failures'] < CIRCUIT_FAILURE_THRESHOLD:
+        return
+    now = time.monotonic()
+    if _circuit['open_until'] > now:
+        raise ServiceUnavailable(math.ceil(_circuit['open_until'] - now))
+    _circuit['open_until'] = now + CIRCUIT_RESET_SECONDS
+
+def circuit_record_success():
+    _circuit['failures'] = 0
+    _circuit['open_until'] = 0.0
+
+def circuit_record_failure() -> int:
+    """Учет отказа БД; возвращает значение Retry-After"""
+    _circuit['failures'] += 1
+    if _circuit['failures'] >= CIRCUIT_FAILURE_THRESHOLD:
+        _circuit['open_until'] = time.monotonic() + CIRCUIT_RESET_SECONDS
+        return CIRCUIT_RESET_SECONDS
+    return 1
+
+def acquire_request_slot() -> bool:
+    """Ограничение одновременных запросов async_handler (MAX_IN_FLIGHT_REQUESTS): лишние сразу получают 503; ожидание пула отдельно ограничено DB_POOL_ACQUIRE_TIMEOUT"""
+    global _in_flight
+    if _in_flight >= MAX_IN_FLIGHT_REQUESTS:
+        return False
+    _in_flight += 1
+    return True
+
+def release_request_slot():
+    global _in_flight
+    _in_flight -= 1
+
+async def acquire_connection(pool: asyncpg.Pool) -> asyncpg.Connection:
+    """Соединение из пула не дольше DB_POOL_ACQUIRE_TIMEOUT: при занятом пуле запрос завершается 503"""
+    try:
+        return await pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError as e:
+        raise ServiceUnavailable(1) from e
+
+def run_sync(coro: Coroutine) -> Any:
+    """Выполнение корутины без event loop: синхронные адаптеры никогда не приостанавливаются"""
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError('Корутина приостановилась в синхронном режиме')
+
+def replica_urls() -> List[str]:
+    """Список реплик из DATABASE_REPLICA_URL (через запятую)"""
+    return [url.strip() for url in os.environ.get('DATABASE_REPLICA_URL', '').split(',') if url.strip()]
+
+def replica_lag_expired(dsn: str) -> bool:
+    """Нужна ли новая проверка задержки реплики"""
+    checked = _replica_lag.get(dsn)
+    return checked is None or time.monotonic() - checked[0] > REPLICA_LAG_CHECK_INTERVAL
+
+def record_replica_lag(dsn: str, lag: float):
+    """Сохранение измеренной задержки (inf для недоступной реплики)"""
+    _replica_lag[dsn] = (time.monotonic(), lag)
+
+def replica_is_fresh(dsn: str) -> bool:
+    """Реплика отстает не больше REPLICA_MAX_LAG_SECONDS"""
+    checked = _replica_lag.get(dsn)
+    return checked is not None and checked[1] <= REPLICA_MAX_LAG_SECONDS
+
+class SyncDatabase:
+    """Доступ к БД через psycopg2: одно соединение на запрос к primary и к каждой использованной реплике"""
+
+    def __init__(self, dsn: Optional[str]):
+        self.dsn = dsn
+        self.connections: Dict[Optional[str], Any] = {}
+        self.timeouts: Dict[Optional[str], int] = {}
+        self.statement_timeout_ms = DB_STATEMENT_TIMEOUT_MS
+        self.wrote = False
+
+    def _query(self, dsn: Optional[str], query: str, params: Sequence[Any], fetch: Optional[str]) -> Any:
+        conn = self.connections.get(dsn)
+        if conn is None:
+            conn = psycopg2.connect(
+                dsn, connect_timeout=DB_CONNECT_TIMEOUT, options=f'-c statement_timeout={self.statement_timeout_ms}'
+            )
+            conn.autocommit = True
+            self.connections[dsn] = conn
+            self.timeouts[dsn] = self.statement_timeout_ms
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            if self.timeouts.get(dsn) != self.statement_timeout_ms:
+                cur.execute("SET statement_timeout = %s", (self.statement_timeout_ms,))
+                self.timeouts[dsn] = self.statement_timeout_ms
+            cur.execute(query, params)
+            if fetch == 'one':
+                row = cur.fetchone()
+                return dict(row) if row else None
+            if fetch == 'all':
+                return [dict(row) for row in cur.fetchall()]
+        return None
+
+    def _primary(self, query: str, params: Sequence[Any], fetch: Optional[str]) -> Any:
+        circuit_check()
+        try:
+            result = self._query(self.dsn, query, params, fetch)
+        except psycopg2.OperationalError as e:
+            print(f"Database error: {e}")
+            self._drop(self.dsn)
+            raise ServiceUnavailable(circuit_record_failure()) from e
+        circuit_record_success()
+        return result
+
+    def _drop(self, dsn: Optional[str]):
+        self.timeouts.pop(dsn, None)
+        conn = self.connections.pop(dsn, None)
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _replica(self) -> Optional[str]:
+        if self.wrote:
+            return None
+        replicas = replica_urls()
+        for dsn in random.sample(replicas, len(replicas)):
+            if replica_lag_expired(dsn):
+                try:
+                    record_replica_lag(dsn, float(self._query(dsn, REPLICA_LAG_QUERY, (), 'one')['lag']))
+                except Exception:
+                    record_replica_lag(dsn, float('inf'))
+                    self._drop(dsn)
+            if replica_is_fresh(dsn):
+                return dsn
+        return None
+
+    def _read(self, query: str, params: Sequence[Any], fetch: str, readonly: bool, retry_empty: bool = False) -> Any:
+        replica = self._replica() if readonly else None
+        if replica is not None:
+            try:
+                result = self._query(replica, query, params, fetch)
+                if result or not retry_empty:
+                    return result
+            except Exception:
+                record_replica_lag(replica, float('inf'))
+                self._drop(replica)
+        return self._primary(query, params, fetch)
+
+    async def fetchone(self, query: str, params: Sequence[Any] = (), readonly: bool = False, retry_empty: bool = False) -> Optional[Dict[str, Any]]:
+        return self._read(query, params, 'one', readonly, retry_empty)
+
+    async def fetchall(self, query: str, params: Sequence[Any] = (), readonly: bool = False) -> List[Dict[str, Any]]:
+        return self._read(query, params, 'all', readonly)
+
+    async def execute(self, query: str, params: Sequence[Any] = ()) -> None:
+        self.wrote = True
+        self._primary(query, params, None)
+
+    def close(self):
+        for dsn in list(self.connections):
+            self._drop(dsn)
+
+async def get_pool(dsn: Optional[str] = None) -> asyncpg.Pool:
+    """Ленивое создание пула соединений asyncpg (один на процесс для primary и каждой реплики)"""
+    dsn = dsn or DATABASE_URL
+    pool = _pools.get(dsn)
+    if pool is None:
+        async with _pool_lock:
+            pool = _pools.get(dsn)
+            if pool is None:
+                pool = await asyncpg.create_pool(
+                    dsn, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                    timeout=DB_CONNECT_TIMEOUT
+                )
+                _pools[dsn] = pool
+    return pool
+
+class AsyncDatabase:
+    """Доступ к БД через пулы asyncpg: соединение берется из пула на время запроса"""
+
+    def __init__(self):
+        self.statement_timeout_ms = DB_STATEMENT_TIMEOUT_MS
+        self.wrote = False
+
+    async def _query(self, dsn: Optional[str], query: str, params: Sequence[Any], fetch: Optional[str]) -> Any:
+        pool = await get_pool(dsn)
+        timeout = self.statement_timeout_ms / 1000
+        connection = await acquire_connection(pool)
+        try:
+            if fetch == 'one':
+                row = await connection.fetchrow(to_asyncpg_query(query), *params, timeout=timeout)
+                return dict(row) if row else None
+            if fetch == 'all':
+                return [dict(row) for row in await connection.fetch(to_asyncpg_query(query), *params, timeout=timeout)]
+            await connection.execute(to_asyncpg_query(query), *params, timeout=timeout)
+            return None
+        finally:
+            await pool.release(connection)
+
+    async def _primary(self, query: str, params: Sequence[Any], fetch: Optional[str]) -> Any:
+        circuit_check()
+        try:
+            result = await self._query(DATABASE_URL, query, params, fetch)
+        except ASYNC_DB_FAILURES as e:
+            print(f"Database error: {e}")
+            raise ServiceUnavailable(circuit_record_failure()) from e
+        circuit_record_success()
+        return result
+
+    async def _replica(self) -> Optional[str]:
+        if self.wrote:
+            return None
+        replicas = replica_urls()
+        for dsn in random.sample(replicas, len(replicas)):
+            if replica_lag_expired(dsn):
+                try:
+                    record_replica_lag(dsn, float((await self._query(dsn, REPLICA_LAG_QUERY, (), 'one'))['lag']))
+                except Exception:
+                    record_replica_lag(dsn, float('inf'))
+            if replica_is_fresh(dsn):
+                return dsn
+        return None
+
+    async def _read(self, query: str, params: Sequence[Any], fetch: str, readonly: bool, retry_empty: bool = False) -> Any:
+        replica = await self._replica() if readonly else None
+        if replica is not None:
+            try:
+                result = await self._query(replica, query, params, fetch)
+                if result or not retry_empty:
+                    return result
+            except ServiceUnavailable:
+                pass
+            except Exception:
+                record_replica_lag(replica, float('inf'))
+        return await self._primary(query, params, fetch)
+
+    async def fetchone(self, query: str, params: Sequence[Any] = (), readonly: bool = False, retry_empty: bool = False) -> Optional[Dict[str, Any]]:
+        return await self._read(query, params, 'one', readonly, retry_empty)
+
+    async def fetchall(self, query: str, params: Sequence[Any] = (), readonly: bool = False) -> List[Dict[str, Any]]:
+        return await self._read(query, params, 'all', readonly)
 
-def create_session(user_id: int, ip_address: str, user_agent: str) -> str:
+    async def execute(self, query: str, params: Sequence[Any] = ()) -> None:
+        self.wrote = True
+        await self._primary(query, params, None)
+
+async def create_session(db, user_id: int, ip_address: str, user_agent: str) -> str:
     """Создание сессии пользователя"""
     token = secrets.token_urlsafe(32)
-    expires_at = (datetime.now() + timedelta(days=7)).isoformat()
-    
-    conn = psycopg2.connect(DATABASE_URL)
-    cur = conn.cursor()
-    
-    safe_token = escape_sql_string(token)
-    safe_ip = escape_sql_string(ip_address)
-    safe_ua = escape_sql_string(user_agent)
-    
-    query = f"INSERT INTO sessions (user_id, token, ip_address, user_agent, expires_at) VALUES ({user_id}, '{safe_token}', '{safe_ip}', '{safe_ua}', '{expires_at}')"
-    cur.execute(query)
-    
-    conn.commit()
-    cur.close()
-    conn.close()
-    
+    expires_at = datetime.now() + timedelta(days=7)
+
+    await db.execute(
+        "INSERT INTO sessions (user_id, token, ip_address, user_agent, expires_at) VALUES (%s, %s, %s, %s, %s)",
+        (user_id, token, ip_address, user_agent, expires_at)
+    )
+
     return token
 
-def log_activity(user_id: Optional[int], user_email: str, action: str, ip_address: str, user_agent: str, entity_type: Optional[str] = None):
+async def log_activity(db, user_id: Optional[int], user_email: str, action: str, ip_address: str, user_agent: str, entity_type: Optional[str] = None):
     """Логирование активности"""
-    conn = psycopg2.connect(DATABASE_URL)
-    cur = conn.cursor()
-    
-    safe_email = escape_sql_string(user_email)
-    safe_action = escape_sql_string(action)
-    safe_ip = escape_sql_string(ip_address)
-    safe_ua = escape_sql_string(user_agent)
-    user_id_str = str(user_id) if user_id else 'NULL'
-    entity_type_str = f"'{escape_sql_string(entity_type)}'" if entity_type else 'NULL'
-    
-    query = f"INSERT INTO activity_logs (user_id, user_email, action, entity_type, ip_address, user_agent) VALUES ({user_id_str}, '{safe_email}', '{safe_action}', {entity_type_str}, '{safe_ip}', '{safe_ua}')"
-    cur.execute(query)
-    
-    conn.commit()
-    cur.close()
-    conn.close()
+    await db.execute(
+        "INSERT INTO activity_logs (user_id, user_email, action, entity_type, ip_address, user_agent) VALUES (%s, %s, %s, %s, %s, %s)",
+        (user_id or None, user_email, action, entity_type or None, ip_address, user_agent)
+    )
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+async def handle_request(event: Dict[str, Any], db) -> Dict[str, Any]:
+    """Обработка запроса, общая для синхронного и асинхронного handler"""
     method: str = event.get('httpMethod', 'GET')
-    
+
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
@@ -82,172 +435,119 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': '',
             'isBase64Encoded': False
         }
-    
+
     if method == 'POST':
         try:
             body_data = json.loads(event.get('body', '{}'))
             action = body_data.get('action')
-            
+            db.statement_timeout_ms = STATEMENT_TIMEOUTS_MS.get(action, DB_STATEMENT_TIMEOUT_MS)
+
             ip_address = event.get('requestContext', {}).get('identity', {}).get('sourceIp', '')
             user_agent = event.get('headers', {}).get('user-agent', '')
-            
+
             if action == 'login':
                 email = body_data.get('email', '').strip().lower()
                 password = body_data.get('password', '')
-                
+
                 print(f"DEBUG: Login attempt - email: {email}, password length: {len(password)}")
-                
+
                 if not email or not password:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Email и пароль обязательны'}),
-                        'isBase64Encoded': False
-                    }
-                
-                conn = psycopg2.connect(DATABASE_URL)
-                cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-                
-                safe_email = escape_sql_string(email)
-                query = f"SELECT id, email, password_hash, full_name, role, is_active FROM users WHERE email = '{safe_email}'"
-                cur.execute(query)
-                user = cur.fetchone()
-                
+                    return json_response(400, {'error': 'Email и пароль обязательны'})
+
+                user = await db.fetchone(
+                    "SELECT id, email, password_hash, full_name, role, is_active FROM users WHERE email = %s",
+                    (email,)
+                )
+
                 print(f"DEBUG: User found: {user is not None}, Active: {user['is_active'] if user else 'N/A'}")
-                
+
                 if not user or not user['is_active']:
-                    log_activity(None, email, 'login_failed', ip_address, user_agent)
-                    cur.close()
-                    conn.close()
-                    return {
-                        'statusCode': 401,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Неверный email или пароль'}),
-                        'isBase64Encoded': False
-                    }
-                
+                    await log_activity(db, None, email, 'login_failed', ip_address, user_agent)
+                    return json_response(401, {'error': 'Неверный email или пароль'})
+
                 password_hash_calculated = hash_password(password)
                 password_match = verify_password(password, user['password_hash'])
                 print(f"DEBUG: Password hash calculated: {password_hash_calculated}")
                 print(f"DEBUG: Password hash in DB: {user['password_hash']}")
                 print(f"DEBUG: Password match: {password_match}")
-                
+
                 if not password_match:
-                    log_activity(user['id'], email, 'login_failed', ip_address, user_agent)
-                    cur.close()
-                    conn.close()
-                    return {
-                        'statusCode': 401,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Неверный email или пароль'}),
-                        'isBase64Encoded': False
+                    await log_activity(db, user['id'], email, 'login_failed', ip_address, user_agent)
+                    return json_response(401, {'error': 'Неверный email или пароль'})
+
+                await db.execute("UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = %s", (user['id'],))
+
+                token = await create_session(db, user['id'], ip_address, user_agent)
+                await log_activity(db, user['id'], email, 'login_success', ip_address, user_agent)
+
+                return json_response(200, {
+                    'token': token,
+                    'user': {
+                        'id': user['id'],
+                        'email': user['email'],
+                        'name': user['full_name'],
+                        'role': user['role']
                     }
-                
-                cur.execute(f"UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = {user['id']}")
-                conn.commit()
-                
-                cur.close()
-                conn.close()
-                
-                token = create_session(user['id'], ip_address, user_agent)
-                log_activity(user['id'], email, 'login_success', ip_address, user_agent)
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'token': token,
-                        'user': {
-                            'id': user['id'],
-                            'email': user['email'],
-                            'name': user['full_name'],
-                            'role': user['role']
-                        }
-                    }),
-                    'isBase64Encoded': False
-                }
-            
+                })
+
             elif action == 'verify':
                 token = body_data.get('token', '')
-                
+
                 if not token:
-                    return {
-                        'statusCode': 401,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Токен отсутствует'}),
-                        'isBase64Encoded': False
-                    }
-                
-                conn = psycopg2.connect(DATABASE_URL)
-                cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-                
-                safe_token = escape_sql_string(token)
-                query = f"SELECT s.user_id, u.email, u.full_name, u.role FROM sessions s JOIN users u ON s.user_id = u.id WHERE s.token = '{safe_token}' AND s.expires_at > CURRENT_TIMESTAMP"
-                cur.execute(query)
-                session = cur.fetchone()
-                
-                cur.close()
-                conn.close()
-                
+                    return json_response(401, {'error': 'Токен отсутствует'})
+
+                if SESSION_REPLICA_READS:
+                    # Окно отзыва: выход из системы доходит до реплики не позже REPLICA_MAX_LAG_SECONDS.
+                    # Сессия, которой еще нет на реплике (только что вошли), перепроверяется в primary
+                    session = await db.fetchone(REPLICA_SESSION_QUERY, (token, REPLICA_MAX_LAG_SECONDS), readonly=True, retry_empty=True)
+                else:
+                    session = await db.fetchone(SESSION_QUERY, (token,))
+
                 if not session:
-                    return {
-                        'statusCode': 401,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Недействительный токен'}),
-                        'isBase64Encoded': False
+                    return json_response(401, {'error': 'Недействительный токен'})
+
+                return json_response(200, {
+                    'user': {
+                        'id': session['user_id'],
+                        'email': session['email'],
+                        'name': session['full_name'],
+                        'role': session['role']
                     }
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'user': {
-                            'id': session['user_id'],
-                            'email': session['email'],
-                            'name': session['full_name'],
-                            'role': session['role']
-                        }
-                    }),
-                    'isBase64Encoded': False
-                }
-            
+                })
+
             elif action == 'logout':
                 token = body_data.get('token', '')
-                
+
                 if token:
-                    conn = psycopg2.connect(DATABASE_URL)
-                    cur = conn.cursor()
-                    safe_token = escape_sql_string(token)
-                    cur.execute(f"UPDATE sessions SET expires_at = CURRENT_TIMESTAMP WHERE token = '{safe_token}'")
-                    conn.commit()
-                    cur.close()
-                    conn.close()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'message': 'Выход выполнен'}),
-                    'isBase64Encoded': False
-                }
-            
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Неизвестное действие'}),
-                'isBase64Encoded': False
-            }
-        
+                    await db.execute("UPDATE sessions SET expires_at = CURRENT_TIMESTAMP WHERE token = %s", (token,))
+
+                return json_response(200, {'message': 'Выход выполнен'})
+
+            return json_response(400, {'error': 'Неизвестное действие'})
+
+        except ServiceUnavailable:
+            raise
         except Exception as e:
-            return {
-                'statusCode': 500,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': f'Внутренняя ошибка сервера: {str(e)}'}),
-                'isBase64Encoded': False
-            }
-    
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Метод не поддерживается'}),
-        'isBase64Encoded': False
-    }
\ No newline at end of file
+            print(f"Error: {e}")
+            return json_response(500, {'error': 'Внутренняя ошибка сервера'})
+
+    return json_response(405, {'error': 'Метод не поддерживается'})
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    db = SyncDatabase(DATABASE_URL)
+    try:
+        return compress_response(run_sync(handle_request(event, db)), event)
+    except ServiceUnavailable as e:
+        return unavailable_response(e.retry_after)
+    finally:
+        db.close()
+
+async def async_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    if not acquire_request_slot():
+        return unavailable_response(1)
+    try:
+        return compress_response(await handle_request(event, AsyncDatabase()), event)
+    except ServiceUnavailable as e:
+        return unavailable_response(e.retry_after)
+    finally:
+        release_request_slot()
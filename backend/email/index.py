@@ -4,41 +4,89 @@ Args: event - HTTP запрос с email и назначением кода
       context - контекст выполнения с request_id
 Returns: HTTP ответ с результатом отправки
 """
+import asyncio
+import base64
+import gzip
 import json
+import math
 import os
 import random
+import time
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timedelta
-from typing import Dict, Any
+from typing import Dict, Any, Optional, List, Sequence, Callable, Coroutine
 import psycopg2
 import psycopg2.extras
+import asyncpg
+import aiosmtplib
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 SMTP_HOST = os.environ.get('SMTP_HOST', '')
 SMTP_PORT = int(os.environ.get('SMTP_PORT', '587'))
 SMTP_USER = os.environ.get('SMTP_USER', '')
 SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD', '')
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '10'))
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', '3'))
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', '5000'))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_SECONDS = int(os.environ.get('CIRCUIT_RESET_SECONDS', '30'))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '1'))
+MAX_IN_FLIGHT_REQUESTS = int(os.environ.get('MAX_IN_FLIGHT_REQUESTS', '500'))
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESSION_MIN_BYTES', '1024'))
+RESPONSE_GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', '6'))
+RESPONSE_BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', '5'))
+RESPONSE_ZSTD_LEVEL = int(os.environ.get('RESPONSE_ZSTD_LEVEL', '3'))
+
+STATEMENT_TIMEOUTS_MS = {
+    'send_code': 2000,
+    'verify_code': 2000,
+}
+
+ASYNC_DB_FAILURES = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.exceptions.QueryCanceledError,
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.InsufficientResourcesError,
+    asyncpg.exceptions.OperatorInterventionError,
+    asyncpg.exceptions.InterfaceError,
+)
+
+COMPRESSORS: Dict[str, Callable[[bytes], bytes]] = {}
+try:
+    import brotli
+    COMPRESSORS['br'] = lambda data: brotli.compress(data, quality=RESPONSE_BROTLI_QUALITY)
+except ImportError:
+    pass
+try:
+    import zstandard
+    COMPRESSORS['zstd'] = lambda data: zstandard.ZstdCompressor(level=RESPONSE_ZSTD_LEVEL).compress(data)
+except ImportError:
+    pass
+COMPRESSORS['gzip'] = lambda data: gzip.compress(data, compresslevel=RESPONSE_GZIP_LEVEL)
+
+_pool: Optional[asyncpg.Pool] = None
+_pool_lock = asyncio.Lock()
+_circuit = {'failures': 0, 'open_until': 0.0}
+_in_flight = 0
 
 def generate_code() -> str:
     """Генерация 6-значного кода"""
     return ''.join([str(random.randint(0, 9)) for _ in range(6)])
 
-def send_email(to_email: str, code: str, purpose: str) -> bool:
-    """Отправка email с кодом"""
-    if not all([SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASSWORD]):
-        return True
+def build_message(to_email: str, code: str, purpose: str) -> MIMEMultipart:
+    """Формирование письма с кодом"""
+    subject = 'Код подтверждения для входа' if purpose == 'login' else 'Код восстановления пароля'
     
-    try:
-        subject = 'Код подтверждения для входа' if purpose == 'login' else 'Код восстановления пароля'
-        
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = subject
-        msg['From'] = SMTP_USER
-        msg['To'] = to_email
-        
-        text = f"""
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = SMTP_USER
+    msg['To'] = to_email
+    
+    text = f"""
 Ваш код подтверждения: {code}
 
 Код действителен в течение 10 минут.
@@ -47,9 +95,9 @@ def send_email(to_email: str, code: str, purpose: str) -> bool:
 --
 СтройМонитор
 Система управления инфраструктурными проектами
-        """
-        
-        html = f"""
+    """
+    
+    html = f"""
 <!DOCTYPE html>
 <html>
 <head>
@@ -74,13 +122,27 @@ def send_email(to_email: str, code: str, purpose: str) -> bool:
     </div>
 </body>
 </html>
-        """
-        
-        part1 = MIMEText(text, 'plain', 'utf-8')
-        part2 = MIMEText(html, 'html', 'utf-8')
-        
-        msg.attach(part1)
-        msg.attach(part2)
+    """
+    
+    part1 = MIMEText(text, 'plain', 'utf-8')
+    part2 = MIMEText(html, 'html', 'utf-8')
+    
+    msg.attach(part1)
+    msg.attach(part2)
+    
+    return msg
+
+def smtp_configured() -> bool:
+    """Проверка настроек SMTP"""
+    return all([SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASSWORD])
+
+def send_email(to_email: str, code: str, purpose: str) -> bool:
+    """Отправка email с кодом"""
+    if not smtp_configured():
+        return True
+    
+    try:
+        msg = build_message(to_email, code, purpose)
         
         with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
             server.starttls()
@@ -92,9 +154,258 @@ def send_email(to_email: str, code: str, purpose: str) -> bool:
         print(f"Error sending email: {e}")
         return False
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    method: str = event.get('httpMethod', 'GET')
+async def send_email_async(to_email: str, code: str, purpose: str) -> bool:
+    """Асинхронная отправка email с кодом через aiosmtplib"""
+    if not smtp_configured():
+        return True
     
+    try:
+        msg = build_message(to_email, code, purpose)
+        
+        await aiosmtplib.send(
+            msg,
+            hostname=SMTP_HOST,
+            port=SMTP_PORT,
+            username=SMTP_USER,
+            password=SMTP_PASSWORD,
+            start_tls=True
+        )
+        
+        return True
+    except Exception as e:
+        print(f"Error sending email: {e}")
+        return False
+
+async def _send_email_blocking(to_email: str, code: str, purpose: str) -> bool:
+    return send_email(to_email, code, purpose)
+
+def json_response(status_code: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Формирование JSON ответа"""
+    return {
+        'statusCode': status_code,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **(headers or {})},
+        'body': json.dumps(payload)
+    }
+
+def to_asyncpg_query(query: str) -> str:
+    """Замена плейсхолдеров %s (psycopg2) на $1, $2, ... (asyncpg)"""
+    parts = query.split('%s')
+    return parts[0] + ''.join(f'${i}{part}' for i, part in enumerate(parts[1:], 1))
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Выбор сжатия по Accept-Encoding с учетом q-значений (в порядке предпочтения сервера)"""
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in COMPRESSORS:
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+def compress_response(response: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+    """Сжатие тела ответа больше RESPONSE_COMPRESSION_MIN_BYTES; сжатое тело передается в base64"""
+    body = response.get('body')
+    if not isinstance(body, str) or response.get('isBase64Encoded'):
+        return response
+    raw = body.encode('utf-8')
+    if len(raw) < RESPONSE_COMPRESSION_MIN_BYTES:
+        return response
+
+    headers = {**response.get('headers', {}), 'Vary': 'Accept-Encoding'}
+    request_headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    encoding = negotiate_encoding(request_headers.get('accept-encoding', ''))
+    compressed = COMPRESSORS[encoding](raw) if encoding else None
+    if compressed is None or len(compressed) >= len(raw):
+        return {**response, 'headers': headers}
+
+    headers['Content-Encoding'] = encoding
+    return {
+        **response,
+        'headers': headers,
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+def unavailable_response(retry_after: int) -> Dict[str, Any]:
+    """Ответ 503 при недоступной или перегруженной БД"""
+    return json_response(
+        503,
+        {'error': 'Сервис временно недоступен, повторите запрос позже'},
+        {'Retry-After': str(retry_after)}
+    )
+
+class ServiceUnavailable(Exception):
+    """БД недоступна или не уложилась в таймаут: запрос завершается ответом 503"""
+
+    def __init__(self, retry_after: int):
+        super().__init__('База данных недоступна')
+        self.retry_after = retry_after
+
+def circuit_check():
+    """Быстрый отказ, пока автомат разомкнут; по истечении паузы пропускается один пробный запрос"""
+    if _circuit['failures'] < CIRCUIT_FAILURE_THRESHOLD:
+        return
+    now = time.monotonic()
+    if _circuit['open_until'] > now:
+        raise ServiceUnavailable(math.ceil(_circuit['open_until'] - now))
+    _circuit['open_until'] = now + CIRCUIT_RESET_SECONDS
+
+def circuit_record_success():
+    _circuit['failures'] = 0
+    _circuit['open_until'] = 0.0
+
+def circuit_record_failure() -> int:
+    """Учет отказа БД; возвращает значение Retry-After"""
+    _circuit['failures'] += 1
+    if _circuit['failures'] >= CIRCUIT_FAILURE_THRESHOLD:
+        _circuit['open_until'] = time.monotonic() + CIRCUIT_RESET_SECONDS
+        return CIRCUIT_RESET_SECONDS
+    return 1
+
+def acquire_request_slot() -> bool:
+    """Ограничение одновременных запросов async_handler (MAX_IN_FLIGHT_REQUESTS): лишние сразу получают 503; ожидание пула отдельно ограничено DB_POOL_ACQUIRE_TIMEOUT"""
+    global _in_flight
+    if _in_flight >= MAX_IN_FLIGHT_REQUESTS:
+        return False
+    _in_flight += 1
+    return True
+
+def release_request_slot():
+    global _in_flight
+    _in_flight -= 1
+
+async def acquire_connection(pool: asyncpg.Pool) -> asyncpg.Connection:
+    """Соединение из пула не дольше DB_POOL_ACQUIRE_TIMEOUT: при занятом пуле запрос завершается 503"""
+    try:
+        return await pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError as e:
+        raise ServiceUnavailable(1) from e
+
+def run_sync(coro: Coroutine) -> Any:
+    """Выполнение корутины без event loop: синхронные адаптеры никогда не приостанавливаются"""
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError('Корутина приостановилась в синхронном режиме')
+
+class SyncDatabase:
+    """Доступ к БД через psycopg2: одно соединение на запрос"""
+
+    def __init__(self, dsn: Optional[str]):
+        self.dsn = dsn
+        self.conn = None
+        self.timeout_ms: Optional[int] = None
+        self.statement_timeout_ms = DB_STATEMENT_TIMEOUT_MS
+
+    def _query(self, query: str, params: Sequence[Any], fetch: Optional[str]) -> Any:
+        circuit_check()
+        try:
+            if self.conn is None:
+                self.conn = psycopg2.connect(
+                    self.dsn, connect_timeout=DB_CONNECT_TIMEOUT, options=f'-c statement_timeout={self.statement_timeout_ms}'
+                )
+                self.conn.autocommit = True
+                self.timeout_ms = self.statement_timeout_ms
+            with self.conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                if self.timeout_ms != self.statement_timeout_ms:
+                    cur.execute("SET statement_timeout = %s", (self.statement_timeout_ms,))
+                    self.timeout_ms = self.statement_timeout_ms
+                cur.execute(query, params)
+                if fetch == 'one':
+                    row = cur.fetchone()
+                    result = dict(row) if row else None
+                elif fetch == 'all':
+                    result = [dict(row) for row in cur.fetchall()]
+                else:
+                    result = None
+        except psycopg2.OperationalError as e:
+            print(f"Database error: {e}")
+            self.close()
+            raise ServiceUnavailable(circuit_record_failure()) from e
+        circuit_record_success()
+        return result
+
+    async def fetchone(self, query: str, params: Sequence[Any] = ()) -> Optional[Dict[str, Any]]:
+        return self._query(query, params, 'one')
+
+    async def fetchall(self, query: str, params: Sequence[Any] = ()) -> List[Dict[str, Any]]:
+        return self._query(query, params, 'all')
+
+    async def execute(self, query: str, params: Sequence[Any] = ()) -> None:
+        self._query(query, params, None)
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+            self.timeout_ms = None
+
+async def get_pool() -> asyncpg.Pool:
+    """Ленивое создание пула соединений asyncpg (один на процесс)"""
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await asyncpg.create_pool(
+                    DATABASE_URL, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                    timeout=DB_CONNECT_TIMEOUT
+                )
+    return _pool
+
+class AsyncDatabase:
+    """Доступ к БД через пул asyncpg: соединение берется из пула на время запроса"""
+
+    def __init__(self):
+        self.statement_timeout_ms = DB_STATEMENT_TIMEOUT_MS
+
+    async def _query(self, query: str, params: Sequence[Any], fetch: Optional[str]) -> Any:
+        circuit_check()
+        timeout = self.statement_timeout_ms / 1000
+        try:
+            pool = await get_pool()
+            connection = await acquire_connection(pool)
+            try:
+                if fetch == 'one':
+                    row = await connection.fetchrow(to_asyncpg_query(query), *params, timeout=timeout)
+                    result = dict(row) if row else None
+                elif fetch == 'all':
+                    result = [dict(row) for row in await connection.fetch(to_asyncpg_query(query), *params, timeout=timeout)]
+                else:
+                    result = await connection.execute(to_asyncpg_query(query), *params, timeout=timeout)
+            finally:
+                await pool.release(connection)
+        except ASYNC_DB_FAILURES as e:
+            print(f"Database error: {e}")
+            raise ServiceUnavailable(circuit_record_failure()) from e
+        circuit_record_success()
+        return result
+
+    async def fetchone(self, query: str, params: Sequence[Any] = ()) -> Optional[Dict[str, Any]]:
+        return await self._query(query, params, 'one')
+
+    async def fetchall(self, query: str, params: Sequence[Any] = ()) -> List[Dict[str, Any]]:
+        return await self._query(query, params, 'all')
+
+    async def execute(self, query: str, params: Sequence[Any] = ()) -> None:
+        await self._query(query, params, None)
+
+async def handle_request(event: Dict[str, Any], db, send) -> Dict[str, Any]:
+    """Обработка запроса, общая для синхронного и асинхронного handler"""
+    method: str = event.get('httpMethod', 'GET')
+
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
@@ -106,122 +417,85 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             },
             'body': ''
         }
-    
+
     if method == 'POST':
         try:
             body_data = json.loads(event.get('body', '{}'))
             action = body_data.get('action')
-            
+            db.statement_timeout_ms = STATEMENT_TIMEOUTS_MS.get(action, DB_STATEMENT_TIMEOUT_MS)
+
             if action == 'send_code':
                 email = body_data.get('email', '').strip().lower()
                 purpose = body_data.get('purpose', 'login')
-                
+
                 if not email:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Email обязателен'})
-                    }
-                
-                conn = psycopg2.connect(DATABASE_URL)
-                cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-                
-                cur.execute("SELECT id FROM users WHERE email = %s AND is_active = true", (email,))
-                user = cur.fetchone()
-                
+                    return json_response(400, {'error': 'Email обязателен'})
+
+                user = await db.fetchone("SELECT id FROM users WHERE email = %s AND is_active = true", (email,))
+
                 if not user:
-                    cur.close()
-                    conn.close()
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Пользователь не найден или неактивен'})
-                    }
-                
+                    return json_response(404, {'error': 'Пользователь не найден или неактивен'})
+
                 code = generate_code()
                 expires_at = datetime.now() + timedelta(minutes=10)
-                
-                cur.execute(
+
+                await db.execute(
                     "INSERT INTO verification_codes (email, code, purpose, expires_at) VALUES (%s, %s, %s, %s)",
                     (email, code, purpose, expires_at)
                 )
-                conn.commit()
-                
-                cur.close()
-                conn.close()
-                
-                email_sent = send_email(email, code, purpose)
-                
+
+                email_sent = await send(email, code, purpose)
+
                 if not email_sent:
-                    return {
-                        'statusCode': 500,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Ошибка отправки email', 'code': code})
-                    }
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'message': 'Код отправлен на email'})
-                }
-            
+                    return json_response(500, {'error': 'Ошибка отправки email', 'code': code})
+
+                return json_response(200, {'message': 'Код отправлен на email'})
+
             elif action == 'verify_code':
                 email = body_data.get('email', '').strip().lower()
                 code = body_data.get('code', '').strip()
                 purpose = body_data.get('purpose', 'login')
-                
+
                 if not email or not code:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Email и код обязательны'})
-                    }
-                
-                conn = psycopg2.connect(DATABASE_URL)
-                cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-                
-                cur.execute(
+                    return json_response(400, {'error': 'Email и код обязательны'})
+
+                verification = await db.fetchone(
                     "SELECT id FROM verification_codes WHERE email = %s AND code = %s AND purpose = %s AND used = false AND expires_at > CURRENT_TIMESTAMP ORDER BY created_at DESC LIMIT 1",
                     (email, code, purpose)
                 )
-                verification = cur.fetchone()
-                
+
                 if not verification:
-                    cur.close()
-                    conn.close()
-                    return {
-                        'statusCode': 401,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Неверный или истекший код'})
-                    }
-                
-                cur.execute("UPDATE verification_codes SET used = true WHERE id = %s", (verification['id'],))
-                conn.commit()
-                
-                cur.close()
-                conn.close()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'message': 'Код подтвержден', 'valid': True})
-                }
-            
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Неизвестное действие'})
-            }
-        
+                    return json_response(401, {'error': 'Неверный или истекший код'})
+
+                await db.execute("UPDATE verification_codes SET used = true WHERE id = %s", (verification['id'],))
+
+                return json_response(200, {'message': 'Код подтвержден', 'valid': True})
+
+            return json_response(400, {'error': 'Неизвестное действие'})
+
+        except ServiceUnavailable:
+            raise
         except Exception as e:
-            return {
-                'statusCode': 500,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': str(e)})
-            }
-    
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Метод не поддерживается'})
-    }
+            print(f"Error: {e}")
+            return json_response(500, {'error': 'Внутренняя ошибка сервера'})
+
+    return json_response(405, {'error': 'Метод не поддерживается'})
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    db = SyncDatabase(DATABASE_URL)
+    try:
+        return compress_response(run_sync(handle_request(event, db, _send_email_blocking)), event)
+    except ServiceUnavailable as e:
+        return unavailable_response(e.retry_after)
+    finally:
+        db.close()
+
+async def async_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    if not acquire_request_slot():
+        return unavailable_response(1)
+    try:
+        return compress_response(await handle_request(event, AsyncDatabase(), send_email_async), event)
+    except ServiceUnavailable as e:
+        return unavailable_response(e.retry_after)
+    finally:
+        release_request_slot()
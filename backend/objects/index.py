@@ -0,0 +1,899 @@
+"""
+Business: Объекты проектов на карте: запись с разбором координат и пространственные запросы
+Args: event - HTTP запрос с методом GET/POST, headers содержит X-Auth-Token
+      context - контекст выполнения с request_id
+Returns: HTTP ответ с объектами в области, кластерами или результатом записи
+"""
+import asyncio
+import base64
+import gzip
+import json
+import math
+import os
+import random
+import time
+import re
+from typing import Dict, Any, Optional, List, Sequence, Set, Tuple, Callable, Coroutine
+import psycopg2
+import psycopg2.extras
+import asyncpg
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '10'))
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', '3'))
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', '5000'))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_SECONDS = int(os.environ.get('CIRCUIT_RESET_SECONDS', '30'))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '1'))
+MAX_IN_FLIGHT_REQUESTS = int(os.environ.get('MAX_IN_FLIGHT_REQUESTS', '500'))
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESSION_MIN_BYTES', '1024'))
+RESPONSE_GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', '6'))
+RESPONSE_BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', '5'))
+RESPONSE_ZSTD_LEVEL = int(os.environ.get('RESPONSE_ZSTD_LEVEL', '3'))
+
+STATEMENT_TIMEOUTS_MS = {
+    'verify_session': 1000,
+    'bbox': 3000,
+    'clusters': 3000,
+    'radius': 3000,
+    'nearest': 3000,
+    'save_object': 3000,
+}
+
+ASYNC_DB_FAILURES = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.exceptions.QueryCanceledError,
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.InsufficientResourcesError,
+    asyncpg.exceptions.OperatorInterventionError,
+    asyncpg.exceptions.InterfaceError,
+)
+
+COMPRESSORS: Dict[str, Callable[[bytes], bytes]] = {}
+try:
+    import brotli
+    COMPRESSORS['br'] = lambda data: brotli.compress(data, quality=RESPONSE_BROTLI_QUALITY)
+except ImportError:
+    pass
+try:
+    import zstandard
+    COMPRESSORS['zstd'] = lambda data: zstandard.ZstdCompressor(level=RESPONSE_ZSTD_LEVEL).compress(data)
+except ImportError:
+    pass
+COMPRESSORS['gzip'] = lambda data: gzip.compress(data, compresslevel=RESPONSE_GZIP_LEVEL)
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '5'))
+REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('REPLICA_LAG_CHECK_INTERVAL', '10'))
+SESSION_REPLICA_READS = os.environ.get('SESSION_REPLICA_READS', '0') == '1'
+MAX_OBJECTS_PER_QUERY = int(os.environ.get('MAX_OBJECTS_PER_QUERY', '5000'))
+MAX_COVER_RANGES = 32
+MAX_CLUSTER_CELLS = int(os.environ.get('MAX_CLUSTER_CELLS', '1000'))
+EARTH_RADIUS_M = 6371000
+GEOHASH_PRECISION = 9
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+REPLICA_LAG_EXPRESSION = "CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+REPLICA_LAG_QUERY = f"SELECT {REPLICA_LAG_EXPRESSION} AS lag"
+SESSION_QUERY = "SELECT s.user_id, u.email, u.full_name, u.role FROM sessions s JOIN users u ON s.user_id = u.id WHERE s.token = %s AND s.expires_at > CURRENT_TIMESTAMP"
+# На реплике сессия видна, только пока отставание не больше REPLICA_MAX_LAG_SECONDS (на primary выражение равно 0)
+REPLICA_SESSION_QUERY = f"{SESSION_QUERY} AND {REPLICA_LAG_EXPRESSION} <= %s::float8"
+REPLICA_CAUGHT_UP_QUERY = "SELECT COALESCE(pg_last_wal_replay_lsn() >= %s::text::pg_lsn, false) AS caught_up"
+PRIMARY_LSN_QUERY = "SELECT pg_current_wal_lsn()::text AS lsn"
+LSN_PATTERN = re.compile(r'^[0-9A-Fa-f]{1,8}/[0-9A-Fa-f]{1,8}$')
+
+_pools: Dict[str, asyncpg.Pool] = {}
+_pool_lock = asyncio.Lock()
+_circuit = {'failures': 0, 'open_until': 0.0}
+_in_flight = 0
+_replica_lag: Dict[str, Tuple[float, float]] = {}
+
+def json_response(status_code: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Формирование JSON ответа"""
+    return {
+        'statusCode': status_code,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **(headers or {})},
+        'body': json.dumps(payload)
+    }
+
+def to_asyncpg_query(query: str) -> str:
+    """Замена плейсхолдеров %s (psycopg2) на $1, $2, ... (asyncpg)"""
+    parts = query.split('%s')
+    return parts[0] + ''.join(f'${i}{part}' for i, part in enumerate(parts[1:], 1))
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Выбор сжатия по Accept-Encoding с учетом q-значений (в порядке предпочтения сервера)"""
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in COMPRESSORS:
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+def compress_response(response: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+    """Сжатие тела ответа больше RESPONSE_COMPRESSION_MIN_BYTES; сжатое тело передается в base64"""
+    body = response.get('body')
+    if not isinstance(body, str) or response.get('isBase64Encoded'):
+        return response
+    raw = body.encode('utf-8')
+    if len(raw) < RESPONSE_COMPRESSION_MIN_BYTES:
+        return response
+
+    headers = {**response.get('headers', {}), 'Vary': 'Accept-Encoding'}
+    request_headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    encoding = negotiate_encoding(request_headers.get('accept-encoding', ''))
+    compressed = COMPRESSORS[encoding](raw) if encoding else None
+    if compressed is None or len(compressed) >= len(raw):
+        return {**response, 'headers': headers}
+
+    headers['Content-Encoding'] = encoding
+    return {
+        **response,
+        'headers': headers,
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+def unavailable_response(retry_after: int) -> Dict[str, Any]:
+    """Ответ 503 при недоступной или перегруженной БД"""
+    return json_response(
+        503,
+        {'error': 'Сервис временно недоступен, повторите запрос позже'},
+        {'Retry-After': str(retry_after)}
+    )
+
+class ServiceUnavailable(Exception):
+    """БД недоступна или не уложилась в таймаут: запрос завершается ответом 503"""
+
+    def __init__(self, retry_after: int):
+        super().__init__('База данных недоступна')
+        self.retry_after = retry_after
+
+def circuit_check():
+    """Быстрый отказ, пока автомат разомкнут; по истечении паузы пропускается один пробный запрос"""
+    if _circuit['failures'] < CIRCUIT_FAILURE_THRESHOLD:
+        return
+    now = time.monotonic()
+    if _circuit['open_until'] > now:
+        raise ServiceUnavailable(math.ceil(_circuit['open_until'] - now))
+    _circuit['open_until'] = now + CIRCUIT_RESET_SECONDS
+
+def circuit_record_success():
+    _circuit['failures'] = 0
+    _circuit['open_until'] = 0.0
+
+def circuit_record_failure() -> int:
+    """Учет отказа БД; возвращает значение Retry-After"""
+    _circuit['failures'] += 1
+    if _circuit['failures'] >= CIRCUIT_FAILURE_THRESHOLD:
+        _circuit['open_until'] = time.monotonic() + CIRCUIT_RESET_SECONDS
+        return CIRCUIT_RESET_SECONDS
+    return 1
+
+def acquire_request_slot() -> bool:
+    """Ограничение одновременных запросов async_handler (MAX_IN_FLIGHT_REQUESTS): лишние сразу получают 503; ожидание пула отдельно ограничено DB_POOL_ACQUIRE_TIMEOUT"""
+    global _in_flight
+    if _in_flight >= MAX_IN_FLIGHT_REQUESTS:
+        return False
+    _in_flight += 1
+    return True
+
+def release_request_slot():
+    global _in_flight
+    _in_flight -= 1
+
+async def acquire_connection(pool: asyncpg.Pool) -> asyncpg.Connection:
+    """Соединение из пула не дольше DB_POOL_ACQUIRE_TIMEOUT: при занятом пуле запрос завершается 503"""
+    try:
+        return await pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError as e:
+        raise ServiceUnavailable(1) from e
+
+def run_sync(coro: Coroutine) -> Any:
+    """Выполнение корутины без event loop: синхронные адаптеры никогда не приостанавливаются"""
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError('Корутина приостановилась в синхронном режиме')
+
+def replica_urls() -> List[str]:
+    """Список реплик из DATABASE_REPLICA_URL (через запятую)"""
+    return [url.strip() for url in os.environ.get('DATABASE_REPLICA_URL', '').split(',') if url.strip()]
+
+def request_min_lsn(event: Dict[str, Any]) -> Optional[str]:
+    """LSN последней записи клиента из заголовка X-Min-LSN"""
+    lsn = (event.get('headers') or {}).get('x-min-lsn', '').strip()
+    return lsn if LSN_PATTERN.match(lsn) else None
+
+def replica_lag_expired(dsn: str) -> bool:
+    """Нужна ли новая проверка задержки реплики"""
+    checked = _replica_lag.get(dsn)
+    return checked is None or time.monotonic() - checked[0] > REPLICA_LAG_CHECK_INTERVAL
+
+def record_replica_lag(dsn: str, lag: float):
+    """Сохранение измеренной задержки (inf для недоступной реплики)"""
+    _replica_lag[dsn] = (time.monotonic(), lag)
+
+def replica_is_fresh(dsn: str) -> bool:
+    """Реплика отстает не больше REPLICA_MAX_LAG_SECONDS"""
+    checked = _replica_lag.get(dsn)
+    return checked is not None and checked[1] <= REPLICA_MAX_LAG_SECONDS
+
+class SyncDatabase:
+    """Доступ к БД через psycopg2: одно соединение на запрос к primary и к каждой использованной реплике"""
+
+    def __init__(self, dsn: Optional[str]):
+        self.dsn = dsn
+        self.connections: Dict[Optional[str], Any] = {}
+        self.timeouts: Dict[Optional[str], int] = {}
+        self.statement_timeout_ms = DB_STATEMENT_TIMEOUT_MS
+        self.min_lsn: Optional[str] = None
+        self.caught_up: Set[str] = set()
+        self.wrote = False
+
+    def _query(self, dsn: Optional[str], query: str, params: Sequence[Any], fetch: Optional[str]) -> Any:
+        conn = self.connections.get(dsn)
+        if conn is None:
+            conn = psycopg2.connect(
+                dsn, connect_timeout=DB_CONNECT_TIMEOUT, options=f'-c statement_timeout={self.statement_timeout_ms}'
+            )
+            conn.autocommit = True
+            self.connections[dsn] = conn
+            self.timeouts[dsn] = self.statement_timeout_ms
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            if self.timeouts.get(dsn) != self.statement_timeout_ms:
+                cur.execute("SET statement_timeout = %s", (self.statement_timeout_ms,))
+                self.timeouts[dsn] = self.statement_timeout_ms
+            cur.execute(query, params)
+            if fetch == 'one':
+                row = cur.fetchone()
+                return dict(row) if row else None
+            if fetch == 'all':
+                return [dict(row) for row in cur.fetchall()]
+        return None
+
+    def _primary(self, query: str, params: Sequence[Any], fetch: Optional[str]) -> Any:
+        circuit_check()
+        try:
+            result = self._query(self.dsn, query, params, fetch)
+        except psycopg2.OperationalError as e:
+            print(f"Database error: {e}")
+            self._drop(self.dsn)
+            raise ServiceUnavailable(circuit_record_failure()) from e
+        circuit_record_success()
+        return result
+
+    def _drop(self, dsn: Optional[str]):
+        self.timeouts.pop(dsn, None)
+        conn = self.connections.pop(dsn, None)
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _replica(self) -> Optional[str]:
+        if self.wrote:
+            return None
+        replicas = replica_urls()
+        for dsn in random.sample(replicas, len(replicas)):
+            if replica_lag_expired(dsn):
+                try:
+                    record_replica_lag(dsn, float(self._query(dsn, REPLICA_LAG_QUERY, (), 'one')['lag']))
+                except Exception:
+                    record_replica_lag(dsn, float('inf'))
+                    self._drop(dsn)
+            if replica_is_fresh(dsn) and self._caught_up(dsn):
+                return dsn
+        return None
+
+    def _caught_up(self, dsn: str) -> bool:
+        """Реплика уже воспроизвела последнюю запись клиента (X-Min-LSN)"""
+        if self.min_lsn is None or dsn in self.caught_up:
+            return True
+        try:
+            if self._query(dsn, REPLICA_CAUGHT_UP_QUERY, (self.min_lsn,), 'one')['caught_up']:
+                self.caught_up.add(dsn)
+                return True
+        except Exception as e:
+            print(f"Replica LSN check failed: {e}")
+        return False
+
+    def _read(self, query: str, params: Sequence[Any], fetch: str, readonly: bool, retry_empty: bool = False) -> Any:
+        replica = self._replica() if readonly else None
+        if replica is not None:
+            try:
+                result = self._query(replica, query, params, fetch)
+                if result or not retry_empty:
+                    return result
+            except Exception:
+                record_replica_lag(replica, float('inf'))
+                self._drop(replica)
+        return self._primary(query, params, fetch)
+
+    async def write_lsn(self) -> Optional[str]:
+        """Позиция WAL primary после записей запроса; возвращается клиенту, только если есть реплики"""
+        if not self.wrote or not replica_urls():
+            return None
+        try:
+            return self._primary(PRIMARY_LSN_QUERY, (), 'one')['lsn']
+        except ServiceUnavailable:
+            return None
+
+    async def fetchone(self, query: str, params: Sequence[Any] = (), readonly: bool = False, retry_empty: bool = False) -> Optional[Dict[str, Any]]:
+        return self._read(query, params, 'one', readonly, retry_empty)
+
+    async def fetchall(self, query: str, params: Sequence[Any] = (), readonly: bool = False) -> List[Dict[str, Any]]:
+        return self._read(query, params, 'all', readonly)
+
+    async def execute(self, query: str, params: Sequence[Any] = ()) -> None:
+        self.wrote = True
+        self._primary(query, params, None)
+
+    def close(self):
+        for dsn in list(self.connections):
+            self._drop(dsn)
+
+async def _init_connection(conn: asyncpg.Connection):
+    """JSONB в виде dict, как в psycopg2; строки передаются как есть (уже сериализованный JSON)"""
+    await conn.set_type_codec(
+        'jsonb',
+        encoder=lambda value: value if isinstance(value, str) else json.dumps(value),
+        decoder=json.loads,
+        schema='pg_catalog'
+    )
+
+async def get_pool(dsn: Optional[str] = None) -> asyncpg.Pool:
+    """Ленивое создание пула соединений asyncpg (один на процесс для primary и каждой реплики)"""
+    dsn = dsn or DATABASE_URL
+    pool = _pools.get(dsn)
+    if pool is None:
+        async with _pool_lock:
+            pool = _pools.get(dsn)
+            if pool is None:
+                pool = await asyncpg.create_pool(
+                    dsn, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                    timeout=DB_CONNECT_TIMEOUT, init=_init_connection
+                )
+                _pools[dsn] = pool
+    return pool
+
+class AsyncDatabase:
+    """Доступ к БД через пулы asyncpg: соединение берется из пула на время запроса"""
+
+    def __init__(self):
+        self.statement_timeout_ms = DB_STATEMENT_TIMEOUT_MS
+        self.min_lsn: Optional[str] = None
+        self.caught_up: Set[str] = set()
+        self.wrote = False
+
+    async def _query(self, dsn: Optional[str], query: str, params: Sequence[Any], fetch: Optional[str]) -> Any:
+        pool = await get_pool(dsn)
+        timeout = self.statement_timeout_ms / 1000
+        connection = await acquire_connection(pool)
+        try:
+            if fetch == 'one':
+                row = await connection.fetchrow(to_asyncpg_query(query), *params, timeout=timeout)
+                return dict(row) if row else None
+            if fetch == 'all':
+                return [dict(row) for row in await connection.fetch(to_asyncpg_query(query), *params, timeout=timeout)]
+            await connection.execute(to_asyncpg_query(query), *params, timeout=timeout)
+            return None
+        finally:
+            await pool.release(connection)
+
+    async def _primary(self, query: str, params: Sequence[Any], fetch: Optional[str]) -> Any:
+        circuit_check()
+        try:
+            result = await self._query(DATABASE_URL, query, params, fetch)
+        except ASYNC_DB_FAILURES as e:
+            print(f"Database error: {e}")
+            raise ServiceUnavailable(circuit_record_failure()) from e
+        circuit_record_success()
+        return result
+
+    async def _replica(self) -> Optional[str]:
+        if self.wrote:
+            return None
+        replicas = replica_urls()
+        for dsn in random.sample(replicas, len(replicas)):
+            if replica_lag_expired(dsn):
+                try:
+                    record_replica_lag(dsn, float((await self._query(dsn, REPLICA_LAG_QUERY, (), 'one'))['lag']))
+                except Exception:
+                    record_replica_lag(dsn, float('inf'))
+            if replica_is_fresh(dsn) and await self._caught_up(dsn):
+                return dsn
+        return None
+
+    async def _caught_up(self, dsn: str) -> bool:
+        """Реплика уже воспроизвела последнюю запись клиента (X-Min-LSN)"""
+        if self.min_lsn is None or dsn in self.caught_up:
+            return True
+        try:
+            if (await self._query(dsn, REPLICA_CAUGHT_UP_QUERY, (self.min_lsn,), 'one'))['caught_up']:
+                self.caught_up.add(dsn)
+                return True
+        except Exception as e:
+            print(f"Replica LSN check failed: {e}")
+        return False
+
+    async def _read(self, query: str, params: Sequence[Any], fetch: str, readonly: bool, retry_empty: bool = False) -> Any:
+        replica = await self._replica() if readonly else None
+        if replica is not None:
+            try:
+                result = await self._query(replica, query, params, fetch)
+                if result or not retry_empty:
+                    return result
+            except ServiceUnavailable:
+                pass
+            except Exception:
+                record_replica_lag(replica, float('inf'))
+        return await self._primary(query, params, fetch)
+
+    async def write_lsn(self) -> Optional[str]:
+        """Позиция WAL primary после записей запроса; возвращается клиенту, только если есть реплики"""
+        if not self.wrote or not replica_urls():
+            return None
+        try:
+            return (await self._primary(PRIMARY_LSN_QUERY, (), 'one'))['lsn']
+        except ServiceUnavailable:
+            return None
+
+    async def fetchone(self, query: str, params: Sequence[Any] = (), readonly: bool = False, retry_empty: bool = False) -> Optional[Dict[str, Any]]:
+        return await self._read(query, params, 'one', readonly, retry_empty)
+
+    async def fetchall(self, query: str, params: Sequence[Any] = (), readonly: bool = False) -> List[Dict[str, Any]]:
+        return await self._read(query, params, 'all', readonly)
+
+    async def execute(self, query: str, params: Sequence[Any] = ()) -> None:
+        self.wrote = True
+        await self._primary(query, params, None)
+
+COORDINATE_PATTERN = re.compile(r'(-?\d+(?:[.,]\d+)?)|(?<![^\W\d_])([NSEWСЮВЗ])(?![^\W\d_])', re.IGNORECASE)
+SOUTH_WEST = ('S', 'W', 'Ю', 'З')
+LAT_HEMISPHERES = ('N', 'S', 'С', 'Ю')
+LON_HEMISPHERES = ('E', 'W', 'В', 'З')
+
+OBJECT_COLUMNS = "id, project_id, name, region, district, location, coordinates, lat, lon, data, updated_at"
+DISTANCE_SQL = "2 * 6371000 * asin(LEAST(1, sqrt(power(sin(radians(lat - %s) / 2), 2) + cos(radians(%s)) * cos(radians(lat)) * power(sin(radians(lon - %s) / 2), 2))))"
+POINT_SQL = "ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography"
+NEAREST_START_RADIUS_M = 1000
+
+_postgis: Dict[str, bool] = {}
+
+def parse_coordinates(value: Optional[str]) -> Optional[Tuple[float, float]]:
+    """Разбор строки координат: '55.7558° N, 37.6173° E', 'N 55.7558 E 37.6173', '55.7558, 37.6173', '37.6° E, 55.7° N'"""
+    if not value:
+        return None
+    numbers: List[float] = []
+    letters: List[str] = []
+    layout = ''
+    for number, hemisphere in COORDINATE_PATTERN.findall(value):
+        if number:
+            numbers.append(float(number.replace(',', '.')))
+            layout += 'n'
+        else:
+            letters.append(hemisphere.upper())
+            layout += 'h'
+
+    # Полушария либо у обоих чисел после них, либо у обоих перед ними; иначе привязка неоднозначна
+    if layout == 'nn':
+        letters = ['', '']
+    elif layout not in ('nhnh', 'hnhn'):
+        return None
+
+    (lat, first), (lon, second) = [
+        (-abs(coordinate) if hemisphere in SOUTH_WEST else coordinate, hemisphere)
+        for coordinate, hemisphere in zip(numbers, letters)
+    ]
+    if first and (first in LAT_HEMISPHERES) == (second in LAT_HEMISPHERES):
+        return None
+    if first in LON_HEMISPHERES:
+        lat, lon = lon, lat
+
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+def geohash_encode(lat: float, lon: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Кодирование точки в geohash"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        bounds, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (bounds[0] + bounds[1]) / 2
+        if value >= mid:
+            bits = bits * 2 + 1
+            bounds[0] = mid
+        else:
+            bits = bits * 2
+            bounds[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+def geohash_cell_size(precision: int) -> Tuple[float, float]:
+    """Размер ячейки geohash в градусах (широта, долгота)"""
+    bits = 5 * precision
+    return 180 / 2 ** (bits // 2), 360 / 2 ** ((bits + 1) // 2)
+
+def geohash_successor(prefix: str) -> Optional[str]:
+    """Наименьшая строка после всех geohash с данным префиксом (None - без верхней границы)"""
+    prefix = prefix.rstrip('z')
+    if not prefix:
+        return None
+    return prefix[:-1] + GEOHASH_ALPHABET[GEOHASH_ALPHABET.index(prefix[-1]) + 1]
+
+def geohash_ranges(min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> List[Tuple[str, Optional[str]]]:
+    """Диапазоны индекса geohash, покрывающие область (самая точная сетка не больше MAX_COVER_RANGES ячеек)"""
+    lon_spans = [(min_lon, max_lon)] if min_lon <= max_lon else [(min_lon, 180.0), (-180.0, max_lon)]
+    best: List[Tuple[str, Optional[str]]] = [('', None)]
+
+    for precision in range(1, GEOHASH_PRECISION + 1):
+        lat_size, lon_size = geohash_cell_size(precision)
+        lat_cells = round(180 / lat_size)
+        lon_cells = round(360 / lon_size)
+        lat_indexes = range(int((min_lat + 90) // lat_size), min(int((max_lat + 90) // lat_size), lat_cells - 1) + 1)
+        lon_indexes = [
+            index
+            for west, east in lon_spans
+            for index in range(int((west + 180) // lon_size), min(int((east + 180) // lon_size), lon_cells - 1) + 1)
+        ]
+        if len(lat_indexes) * len(lon_indexes) > MAX_COVER_RANGES:
+            break
+
+        prefixes = sorted({
+            geohash_encode(-90 + (i + 0.5) * lat_size, -180 + (j + 0.5) * lon_size, precision)
+            for i in lat_indexes for j in lon_indexes
+        })
+        ranges: List[Tuple[str, Optional[str]]] = []
+        for prefix in prefixes:
+            if ranges and ranges[-1][1] is not None and ranges[-1][1].ljust(precision, '0') == prefix:
+                ranges[-1] = (ranges[-1][0], geohash_successor(prefix))
+            else:
+                ranges.append((prefix, geohash_successor(prefix)))
+        best = ranges
+
+    return best
+
+def bbox_condition(min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> Tuple[str, List[Any]]:
+    """Условие WHERE для области: диапазоны geohash по индексу и точная проверка lat/lon"""
+    clauses, params = [], []
+    for low, high in geohash_ranges(min_lat, min_lon, max_lat, max_lon):
+        if high is None:
+            clauses.append("geohash >= %s")
+            params.append(low)
+        else:
+            clauses.append("(geohash >= %s AND geohash < %s)")
+            params.extend([low, high])
+
+    lon_clause = "lon BETWEEN %s AND %s" if min_lon <= max_lon else "(lon >= %s OR lon <= %s)"
+    condition = f"({' OR '.join(clauses)}) AND lat BETWEEN %s AND %s AND {lon_clause}"
+    return condition, params + [min_lat, max_lat, min_lon, max_lon]
+
+def radius_bbox(lat: float, lon: float, radius_m: float) -> Tuple[float, float, float, float]:
+    """Область, описанная вокруг круга (min_lat, min_lon, max_lat, max_lon)"""
+    delta_lat = math.degrees(radius_m / EARTH_RADIUS_M)
+    min_lat, max_lat = max(lat - delta_lat, -90.0), min(lat + delta_lat, 90.0)
+    if min_lat == -90.0 or max_lat == 90.0:
+        return min_lat, -180.0, max_lat, 180.0
+
+    delta_lon = math.degrees(radius_m / (EARTH_RADIUS_M * math.cos(math.radians(lat))))
+    if delta_lon >= 180:
+        return min_lat, -180.0, max_lat, 180.0
+
+    min_lon, max_lon = lon - delta_lon, lon + delta_lon
+    if min_lon < -180:
+        min_lon += 360
+    if max_lon > 180:
+        max_lon -= 360
+    return min_lat, min_lon, max_lat, max_lon
+
+def geohash_cell_count(min_lat: float, min_lon: float, max_lat: float, max_lon: float, precision: int) -> int:
+    """Оценка сверху числа ячеек geohash данной точности, пересекающих область"""
+    lat_size, lon_size = geohash_cell_size(precision)
+    lon_span = max_lon - min_lon if min_lon <= max_lon else 360 - (min_lon - max_lon)
+    return (math.floor((max_lat - min_lat) / lat_size) + 2) * (math.floor(lon_span / lon_size) + 2)
+
+def cluster_precision(zoom: int, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> int:
+    """Точность geohash для кластеров: ячейка не больше четверти тайла на данном zoom, но не больше MAX_CLUSTER_CELLS ячеек на область"""
+    target = 360 / 2 ** (zoom + 2)
+    precision = next((p for p in range(1, GEOHASH_PRECISION + 1) if geohash_cell_size(p)[1] <= target), GEOHASH_PRECISION)
+    while precision > 1 and geohash_cell_count(min_lat, min_lon, max_lat, max_lon, precision) > MAX_CLUSTER_CELLS:
+        precision -= 1
+    return precision
+
+def serialize_object(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Объект для ответа: исходные поля из data плюс нормализованные колонки"""
+    data = row.get('data') or {}
+    if isinstance(data, str):
+        data = json.loads(data)
+    result = {
+        **data,
+        'id': row['id'],
+        'projectId': row['project_id'],
+        'name': row['name'],
+        'region': row['region'],
+        'district': row['district'],
+        'location': row['location'],
+        'coordinates': row['coordinates'],
+        'lat': row['lat'],
+        'lon': row['lon'],
+        'updatedAt': row['updated_at'].isoformat() if row.get('updated_at') else None
+    }
+    if row.get('distance') is not None:
+        result['distance'] = round(float(row['distance']), 1)
+    return result
+
+async def postgis_enabled(db) -> bool:
+    """Есть ли geography-колонка (миграция создает ее только при доступном PostGIS)"""
+    if 'enabled' not in _postgis:
+        row = await db.fetchone(
+            "SELECT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'project_objects' AND column_name = 'geog') AS enabled",
+            readonly=True
+        )
+        _postgis['enabled'] = bool(row and row['enabled'])
+    return _postgis['enabled']
+
+async def query_radius(db, lat: float, lon: float, radius_m: float, limit: int, project_id: Optional[str]) -> List[Dict[str, Any]]:
+    """Объекты в радиусе, по возрастанию расстояния"""
+    project_clause = " AND project_id = %s" if project_id else ""
+    project_params = [project_id] if project_id else []
+
+    if await postgis_enabled(db):
+        return await db.fetchall(
+            f"SELECT {OBJECT_COLUMNS}, ST_Distance(geog, {POINT_SQL}) AS distance FROM project_objects WHERE ST_DWithin(geog, {POINT_SQL}, %s){project_clause} ORDER BY distance LIMIT %s",
+            [lon, lat, lon, lat, radius_m] + project_params + [limit],
+            readonly=True
+        )
+
+    condition, params = bbox_condition(*radius_bbox(lat, lon, radius_m))
+    return await db.fetchall(
+        f"SELECT * FROM (SELECT {OBJECT_COLUMNS}, {DISTANCE_SQL} AS distance FROM project_objects WHERE {condition}{project_clause}) AS candidates WHERE distance <= %s ORDER BY distance LIMIT %s",
+        [lat, lat, lon] + params + project_params + [radius_m, limit],
+        readonly=True
+    )
+
+async def query_nearest(db, lat: float, lon: float, limit: int, project_id: Optional[str]) -> List[Dict[str, Any]]:
+    """Ближайшие объекты: KNN по GiST в PostGIS или расширяющийся радиус по geohash"""
+    if await postgis_enabled(db):
+        project_clause = " AND project_id = %s" if project_id else ""
+        return await db.fetchall(
+            f"SELECT {OBJECT_COLUMNS}, ST_Distance(geog, {POINT_SQL}) AS distance FROM project_objects WHERE geog IS NOT NULL{project_clause} ORDER BY geog <-> {POINT_SQL} LIMIT %s",
+            [lon, lat] + ([project_id] if project_id else []) + [lon, lat, limit],
+            readonly=True
+        )
+
+    radius_m = NEAREST_START_RADIUS_M
+    while True:
+        rows = await query_radius(db, lat, lon, radius_m, limit, project_id)
+        if len(rows) >= limit or radius_m >= math.pi * EARTH_RADIUS_M:
+            return rows
+        radius_m *= 4
+
+async def verify_session(db, token: str) -> Optional[Dict[str, Any]]:
+    """Проверка сессии и получение данных пользователя (в primary, с SESSION_REPLICA_READS=1 — в реплике)"""
+    if not token:
+        return None
+
+    if SESSION_REPLICA_READS:
+        # Окно отзыва: выход из системы доходит до реплики не позже REPLICA_MAX_LAG_SECONDS.
+        # Сессия, которой еще нет на реплике (только что вошли), перепроверяется в primary
+        return await db.fetchone(REPLICA_SESSION_QUERY, (token, REPLICA_MAX_LAG_SECONDS), readonly=True, retry_empty=True)
+    return await db.fetchone(SESSION_QUERY, (token,))
+
+async def log_activity(db, user_id: int, user_email: str, action: str, entity_type: Optional[str], entity_id: Optional[str], old_values: Optional[Dict], new_values: Optional[Dict], ip_address: str, user_agent: str):
+    """Логирование активности"""
+    await db.execute(
+        "INSERT INTO activity_logs (user_id, user_email, action, entity_type, entity_id, old_values, new_values, ip_address, user_agent) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+        (user_id, user_email, action, entity_type, entity_id,
+         json.dumps(old_values) if old_values else None,
+         json.dumps(new_values) if new_values else None,
+         ip_address, user_agent)
+    )
+
+async def handle_request(event: Dict[str, Any], db) -> Dict[str, Any]:
+    """Обработка запроса, общая для синхронного и асинхронного handler"""
+    method: str = event.get('httpMethod', 'GET')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, X-Min-LSN',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': ''
+        }
+
+    token = event.get('headers', {}).get('x-auth-token', '')
+    db.statement_timeout_ms = STATEMENT_TIMEOUTS_MS['verify_session']
+    user_session = await verify_session(db, token)
+
+    if not user_session:
+        return json_response(401, {'error': 'Требуется авторизация'})
+
+    ip_address = event.get('requestContext', {}).get('identity', {}).get('sourceIp', '')
+    user_agent = event.get('headers', {}).get('user-agent', '')
+
+    if method == 'GET':
+        query_params = event.get('queryStringParameters', {}) or {}
+        action = query_params.get('action', 'bbox')
+        db.statement_timeout_ms = STATEMENT_TIMEOUTS_MS.get(action, DB_STATEMENT_TIMEOUT_MS)
+        project_id = query_params.get('project_id') or None
+
+        try:
+            limit = min(int(query_params.get('limit', 10 if action == 'nearest' else MAX_OBJECTS_PER_QUERY)), MAX_OBJECTS_PER_QUERY)
+            if limit < 1:
+                raise ValueError('limit')
+
+            if action in ('bbox', 'clusters'):
+                min_lat = float(query_params['min_lat'])
+                min_lon = float(query_params['min_lon'])
+                max_lat = float(query_params['max_lat'])
+                max_lon = float(query_params['max_lon'])
+                if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+                    raise ValueError('bbox')
+                if action == 'clusters':
+                    zoom = max(0, min(int(query_params.get('zoom', 10)), 22))
+            elif action in ('radius', 'nearest'):
+                lat = float(query_params['lat'])
+                lon = float(query_params['lon'])
+                if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                    raise ValueError('point')
+                if action == 'radius':
+                    radius_m = float(query_params['radius'])
+                    if not (0 <= radius_m < math.inf):
+                        raise ValueError('radius')
+                    radius_m = min(radius_m, math.pi * EARTH_RADIUS_M)
+        except (KeyError, ValueError):
+            return json_response(400, {'error': 'Некорректные параметры запроса'})
+
+        project_clause = " AND project_id = %s" if project_id else ""
+        project_params = [project_id] if project_id else []
+
+        try:
+            if action == 'bbox':
+                condition, params = bbox_condition(min_lat, min_lon, max_lat, max_lon)
+                # Лишняя строка сверх limit показывает клиенту, что в области есть еще объекты
+                rows = await db.fetchall(
+                    f"SELECT {OBJECT_COLUMNS} FROM project_objects WHERE {condition}{project_clause} LIMIT %s",
+                    params + project_params + [limit + 1],
+                    readonly=True
+                )
+                return json_response(200, {'objects': [serialize_object(row) for row in rows[:limit]], 'truncated': len(rows) > limit})
+
+            elif action == 'clusters':
+                precision = cluster_precision(zoom, min_lat, min_lon, max_lat, max_lon)
+                condition, params = bbox_condition(min_lat, min_lon, max_lat, max_lon)
+                rows = await db.fetchall(
+                    f"SELECT substr(geohash, 1, %s) AS cell, COUNT(*) AS count, AVG(lat) AS lat, AVG(lon) AS lon, CASE WHEN COUNT(*) = 1 THEN MIN(id) END AS object_id FROM project_objects WHERE {condition}{project_clause} GROUP BY cell LIMIT %s",
+                    [precision] + params + project_params + [MAX_CLUSTER_CELLS],
+                    readonly=True
+                )
+                clusters = [
+                    {
+                        'cell': row['cell'],
+                        'count': row['count'],
+                        'lat': float(row['lat']),
+                        'lon': float(row['lon']),
+                        'objectId': row['object_id']
+                    }
+                    for row in rows
+                ]
+                return json_response(200, {'zoom': zoom, 'clusters': clusters})
+
+            elif action == 'radius':
+                rows = await query_radius(db, lat, lon, radius_m, limit + 1, project_id)
+                return json_response(200, {'objects': [serialize_object(row) for row in rows[:limit]], 'truncated': len(rows) > limit})
+
+            elif action == 'nearest':
+                rows = await query_nearest(db, lat, lon, limit, project_id)
+                return json_response(200, {'objects': [serialize_object(row) for row in rows]})
+
+        except ServiceUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error: {e}")
+            return json_response(500, {'error': 'Внутренняя ошибка сервера'})
+
+    elif method == 'POST':
+        try:
+            body_data = json.loads(event.get('body', '{}'))
+            action = body_data.get('action')
+            db.statement_timeout_ms = STATEMENT_TIMEOUTS_MS.get(action, DB_STATEMENT_TIMEOUT_MS)
+
+            if action == 'save_object':
+                obj = body_data.get('object') or {}
+                object_id = str(obj.get('id', '')).strip()
+                project_id = str(body_data.get('project_id', '')).strip()
+                name = obj.get('name', '')
+
+                if not object_id or not project_id or not name:
+                    return json_response(400, {'error': 'ID объекта, ID проекта и название обязательны'})
+
+                point = parse_coordinates(obj.get('coordinates'))
+                lat, lon = point if point else (None, None)
+                geohash = geohash_encode(lat, lon) if point else None
+
+                await db.execute(
+                    "INSERT INTO project_objects (id, project_id, name, region, district, location, coordinates, lat, lon, geohash, data) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) "
+                    "ON CONFLICT (id) DO UPDATE SET project_id = EXCLUDED.project_id, name = EXCLUDED.name, region = EXCLUDED.region, district = EXCLUDED.district, "
+                    "location = EXCLUDED.location, coordinates = EXCLUDED.coordinates, lat = EXCLUDED.lat, lon = EXCLUDED.lon, geohash = EXCLUDED.geohash, "
+                    "data = EXCLUDED.data, updated_at = CURRENT_TIMESTAMP",
+                    (object_id, project_id, name, obj.get('region'), obj.get('district'), obj.get('location'),
+                     obj.get('coordinates'), lat, lon, geohash, json.dumps(obj))
+                )
+
+                await log_activity(
+                    db,
+                    user_session['user_id'],
+                    user_session['email'],
+                    'object_saved',
+                    'object',
+                    object_id,
+                    None,
+                    {'name': name, 'coordinates': obj.get('coordinates')},
+                    ip_address,
+                    user_agent
+                )
+
+                response = {'id': object_id, 'lat': lat, 'lon': lon, 'message': 'Объект сохранен'}
+                if obj.get('coordinates') and not point:
+                    response['warning'] = 'Не удалось разобрать координаты'
+                return json_response(200, response)
+
+            return json_response(400, {'error': 'Неизвестное действие'})
+
+        except ServiceUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error: {e}")
+            return json_response(500, {'error': 'Внутренняя ошибка сервера'})
+
+    return json_response(405, {'error': 'Метод не поддерживается'})
+
+async def handle_consistent_request(event: Dict[str, Any], db) -> Dict[str, Any]:
+    """Read-your-writes между экземплярами функции: клиент возвращает полученный X-Min-LSN в следующих запросах"""
+    db.min_lsn = request_min_lsn(event)
+    response = await handle_request(event, db)
+    lsn = await db.write_lsn()
+    if lsn:
+        response['headers'].update({'X-Min-LSN': lsn, 'Access-Control-Expose-Headers': 'X-Min-LSN'})
+    return response
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    db = SyncDatabase(DATABASE_URL)
+    try:
+        return compress_response(run_sync(handle_consistent_request(event, db)), event)
+    except ServiceUnavailable as e:
+        return unavailable_response(e.retry_after)
+    finally:
+        db.close()
+
+async def async_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    if not acquire_request_slot():
+        return unavailable_response(1)
+    try:
+        return compress_response(await handle_consistent_request(event, AsyncDatabase()), event)
+    except ServiceUnavailable as e:
+        return unavailable_response(e.retry_after)
+    finally:
+        release_request_slot()
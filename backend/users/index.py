@@ -4,197 +4,632 @@ Args: event - HTTP запрос с методом GET/POST, headers содерж
       context - контекст выполнения с request_id
 Returns: HTTP ответ со списком пользователей, логами или результатом операции
 """
+import asyncio
+import base64
+import gzip
 import json
+import math
 import os
+import random
+import re
+import time
 import hashlib
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Sequence, Set, Tuple, Callable, Coroutine
 import psycopg2
 import psycopg2.extras
+import asyncpg
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '10'))
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', '3'))
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', '5000'))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_SECONDS = int(os.environ.get('CIRCUIT_RESET_SECONDS', '30'))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '1'))
+MAX_IN_FLIGHT_REQUESTS = int(os.environ.get('MAX_IN_FLIGHT_REQUESTS', '500'))
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESSION_MIN_BYTES', '1024'))
+RESPONSE_GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', '6'))
+RESPONSE_BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', '5'))
+RESPONSE_ZSTD_LEVEL = int(os.environ.get('RESPONSE_ZSTD_LEVEL', '3'))
+
+STATEMENT_TIMEOUTS_MS = {
+    'verify_session': 1000,
+    'create_user': 3000,
+    'update_user': 3000,
+    'change_password': 3000,
+    'list_users': 10000,
+    'activity_logs': 30000,
+}
+
+ASYNC_DB_FAILURES = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.exceptions.QueryCanceledError,
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.InsufficientResourcesError,
+    asyncpg.exceptions.OperatorInterventionError,
+    asyncpg.exceptions.InterfaceError,
+)
+
+COMPRESSORS: Dict[str, Callable[[bytes], bytes]] = {}
+try:
+    import brotli
+    COMPRESSORS['br'] = lambda data: brotli.compress(data, quality=RESPONSE_BROTLI_QUALITY)
+except ImportError:
+    pass
+try:
+    import zstandard
+    COMPRESSORS['zstd'] = lambda data: zstandard.ZstdCompressor(level=RESPONSE_ZSTD_LEVEL).compress(data)
+except ImportError:
+    pass
+COMPRESSORS['gzip'] = lambda data: gzip.compress(data, compresslevel=RESPONSE_GZIP_LEVEL)
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '5'))
+REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('REPLICA_LAG_CHECK_INTERVAL', '10'))
+SESSION_REPLICA_READS = os.environ.get('SESSION_REPLICA_READS', '0') == '1'
+APPROXIMATE_COUNT_THRESHOLD = int(os.environ.get('APPROXIMATE_COUNT_THRESHOLD', '10000'))
+EXACT_COUNT_CACHE_SECONDS = float(os.environ.get('EXACT_COUNT_CACHE_SECONDS', '30'))
+
+USER_FIELDS = ('id', 'email', 'full_name', 'role', 'is_active', 'created_at', 'last_login')
+LOG_FIELDS = ('id', 'user_id', 'user_email', 'action', 'entity_type', 'entity_id', 'old_values', 'new_values', 'ip_address', 'created_at')
+
+ESTIMATE_QUERY = "SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::bigint AS estimate FROM pg_class c WHERE c.oid = %s::text::regclass OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::text::regclass)"
+
+REPLICA_LAG_EXPRESSION = "CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+REPLICA_LAG_QUERY = f"SELECT {REPLICA_LAG_EXPRESSION} AS lag"
+SESSION_QUERY = "SELECT s.user_id, u.email, u.full_name, u.role FROM sessions s JOIN users u ON s.user_id = u.id WHERE s.token = %s AND s.expires_at > CURRENT_TIMESTAMP"
+# На реплике сессия видна, только пока отставание не больше REPLICA_MAX_LAG_SECONDS (на primary выражение равно 0)
+REPLICA_SESSION_QUERY = f"{SESSION_QUERY} AND {REPLICA_LAG_EXPRESSION} <= %s::float8"
+REPLICA_CAUGHT_UP_QUERY = "SELECT COALESCE(pg_last_wal_replay_lsn() >= %s::text::pg_lsn, false) AS caught_up"
+PRIMARY_LSN_QUERY = "SELECT pg_current_wal_lsn()::text AS lsn"
+LSN_PATTERN = re.compile(r'^[0-9A-Fa-f]{1,8}/[0-9A-Fa-f]{1,8}$')
+
+_pools: Dict[str, asyncpg.Pool] = {}
+_pool_lock = asyncio.Lock()
+_circuit = {'failures': 0, 'open_until': 0.0}
+_in_flight = 0
+_replica_lag: Dict[str, Tuple[float, float]] = {}
+_exact_counts: Dict[str, Tuple[float, int]] = {}
 
 def hash_password(password: str) -> str:
     """Простое хеширование пароля"""
     return hashlib.sha256(password.encode()).hexdigest()
 
-def verify_session(token: str) -> Optional[Dict[str, Any]]:
-    """Проверка сессии и получение данных пользователя"""
-    if not token:
+def json_response(status_code: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Формирование JSON ответа"""
+    return {
+        'statusCode': status_code,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **(headers or {})},
+        'body': json.dumps(payload)
+    }
+
+def to_asyncpg_query(query: str) -> str:
+    """Замена плейсхолдеров %s (psycopg2) на $1, $2, ... (asyncpg)"""
+    parts = query.split('%s')
+    return parts[0] + ''.join(f'${i}{part}' for i, part in enumerate(parts[1:], 1))
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Выбор сжатия по Accept-Encoding с учетом q-значений (в порядке предпочтения сервера)"""
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in COMPRESSORS:
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+def compress_response(response: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+    """Сжатие тела ответа больше RESPONSE_COMPRESSION_MIN_BYTES; сжатое тело передается в base64"""
+    body = response.get('body')
+    if not isinstance(body, str) or response.get('isBase64Encoded'):
+        return response
+    raw = body.encode('utf-8')
+    if len(raw) < RESPONSE_COMPRESSION_MIN_BYTES:
+        return response
+
+    headers = {**response.get('headers', {}), 'Vary': 'Accept-Encoding'}
+    request_headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    encoding = negotiate_encoding(request_headers.get('accept-encoding', ''))
+    compressed = COMPRESSORS[encoding](raw) if encoding else None
+    if compressed is None or len(compressed) >= len(raw):
+        return {**response, 'headers': headers}
+
+    headers['Content-Encoding'] = encoding
+    return {
+        **response,
+        'headers': headers,
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+def unavailable_response(retry_after: int) -> Dict[str, Any]:
+    """Ответ 503 при недоступной или перегруженной БД"""
+    return json_response(
+        503,
+        {'error': 'Сервис временно недоступен, повторите запрос позже'},
+        {'Retry-After': str(retry_after)}
+    )
+
+class ServiceUnavailable(Exception):
+    """БД недоступна или не уложилась в таймаут: запрос завершается ответом 503"""
+
+    def __init__(self, retry_after: int):
+        super().__init__('База данных недоступна')
+        self.retry_after = retry_after
+
+def circuit_check():
+    """Быстрый отказ, пока автомат разомкнут; по истечении паузы пропускается один пробный запрос"""
+    if _circuit['failures'] < CIRCUIT_FAILURE_THRESHOLD:
+        return
+    now = time.monotonic()
+    if _circuit['open_until'] > now:
+        raise ServiceUnavailable(math.ceil(_circuit['open_until'] - now))
+    _circuit['open_until'] = now + CIRCUIT_RESET_SECONDS
+
+def circuit_record_success():
+    _circuit['failures'] = 0
+    _circuit['open_until'] = 0.0
+
+def circuit_record_failure() -> int:
+    """Учет отказа БД; возвращает значение Retry-After"""
+    _circuit['failures'] += 1
+    if _circuit['failures'] >= CIRCUIT_FAILURE_THRESHOLD:
+        _circuit['open_until'] = time.monotonic() + CIRCUIT_RESET_SECONDS
+        return CIRCUIT_RESET_SECONDS
+    return 1
+
+def acquire_request_slot() -> bool:
+    """Ограничение одновременных запросов async_handler (MAX_IN_FLIGHT_REQUESTS): лишние сразу получают 503; ожидание пула отдельно ограничено DB_POOL_ACQUIRE_TIMEOUT"""
+    global _in_flight
+    if _in_flight >= MAX_IN_FLIGHT_REQUESTS:
+        return False
+    _in_flight += 1
+    return True
+
+def release_request_slot():
+    global _in_flight
+    _in_flight -= 1
+
+async def acquire_connection(pool: asyncpg.Pool) -> asyncpg.Connection:
+    """Соединение из пула не дольше DB_POOL_ACQUIRE_TIMEOUT: при занятом пуле запрос завершается 503"""
+    try:
+        return await pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError as e:
+        raise ServiceUnavailable(1) from e
+
+def run_sync(coro: Coroutine) -> Any:
+    """Выполнение корутины без event loop: синхронные адаптеры никогда не приостанавливаются"""
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError('Корутина приостановилась в синхронном режиме')
+
+def replica_urls() -> List[str]:
+    """Список реплик из DATABASE_REPLICA_URL (через запятую)"""
+    return [url.strip() for url in os.environ.get('DATABASE_REPLICA_URL', '').split(',') if url.strip()]
+
+def request_min_lsn(event: Dict[str, Any]) -> Optional[str]:
+    """LSN последней записи клиента из заголовка X-Min-LSN"""
+    lsn = (event.get('headers') or {}).get('x-min-lsn', '').strip()
+    return lsn if LSN_PATTERN.match(lsn) else None
+
+def replica_lag_expired(dsn: str) -> bool:
+    """Нужна ли новая проверка задержки реплики"""
+    checked = _replica_lag.get(dsn)
+    return checked is None or time.monotonic() - checked[0] > REPLICA_LAG_CHECK_INTERVAL
+
+def record_replica_lag(dsn: str, lag: float):
+    """Сохранение измеренной задержки (inf для недоступной реплики)"""
+    _replica_lag[dsn] = (time.monotonic(), lag)
+
+def replica_is_fresh(dsn: str) -> bool:
+    """Реплика отстает не больше REPLICA_MAX_LAG_SECONDS"""
+    checked = _replica_lag.get(dsn)
+    return checked is not None and checked[1] <= REPLICA_MAX_LAG_SECONDS
+
+class SyncDatabase:
+    """Доступ к БД через psycopg2: одно соединение на запрос к primary и к каждой использованной реплике"""
+
+    def __init__(self, dsn: Optional[str]):
+        self.dsn = dsn
+        self.connections: Dict[Optional[str], Any] = {}
+        self.timeouts: Dict[Optional[str], int] = {}
+        self.statement_timeout_ms = DB_STATEMENT_TIMEOUT_MS
+        self.min_lsn: Optional[str] = None
+        self.caught_up: Set[str] = set()
+        self.wrote = False
+
+    def _query(self, dsn: Optional[str], query: str, params: Sequence[Any], fetch: Optional[str]) -> Any:
+        conn = self.connections.get(dsn)
+        if conn is None:
+            conn = psycopg2.connect(
+                dsn, connect_timeout=DB_CONNECT_TIMEOUT, options=f'-c statement_timeout={self.statement_timeout_ms}'
+            )
+            conn.autocommit = True
+            self.connections[dsn] = conn
+            self.timeouts[dsn] = self.statement_timeout_ms
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            if self.timeouts.get(dsn) != self.statement_timeout_ms:
+                cur.execute("SET statement_timeout = %s", (self.statement_timeout_ms,))
+                self.timeouts[dsn] = self.statement_timeout_ms
+            cur.execute(query, params)
+            if fetch == 'one':
+                row = cur.fetchone()
+                return dict(row) if row else None
+            if fetch == 'all':
+                return [dict(row) for row in cur.fetchall()]
         return None
-    
-    conn = psycopg2.connect(DATABASE_URL)
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
-    cur.execute(
-        "SELECT s.user_id, u.email, u.full_name, u.role FROM sessions s JOIN users u ON s.user_id = u.id WHERE s.token = %s AND s.expires_at > CURRENT_TIMESTAMP",
-        (token,)
+
+    def _primary(self, query: str, params: Sequence[Any], fetch: Optional[str]) -> Any:
+        circuit_check()
+        try:
+            result = self._query(self.dsn, query, params, fetch)
+        except psycopg2.OperationalError as e:
+            print(f"Database error: {e}")
+            self._drop(self.dsn)
+            raise ServiceUnavailable(circuit_record_failure()) from e
+        circuit_record_success()
+        return result
+
+    def _drop(self, dsn: Optional[str]):
+        self.timeouts.pop(dsn, None)
+        conn = self.connections.pop(dsn, None)
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _replica(self) -> Optional[str]:
+        if self.wrote:
+            return None
+        replicas = replica_urls()
+        for dsn in random.sample(replicas, len(replicas)):
+            if replica_lag_expired(dsn):
+                try:
+                    record_replica_lag(dsn, float(self._query(dsn, REPLICA_LAG_QUERY, (), 'one')['lag']))
+                except Exception:
+                    record_replica_lag(dsn, float('inf'))
+                    self._drop(dsn)
+            if replica_is_fresh(dsn) and self._caught_up(dsn):
+                return dsn
+        return None
+
+    def _caught_up(self, dsn: str) -> bool:
+        """Реплика уже воспроизвела последнюю запись клиента (X-Min-LSN)"""
+        if self.min_lsn is None or dsn in self.caught_up:
+            return True
+        try:
+            if self._query(dsn, REPLICA_CAUGHT_UP_QUERY, (self.min_lsn,), 'one')['caught_up']:
+                self.caught_up.add(dsn)
+                return True
+        except Exception as e:
+            print(f"Replica LSN check failed: {e}")
+        return False
+
+    def _read(self, query: str, params: Sequence[Any], fetch: str, readonly: bool, retry_empty: bool = False) -> Any:
+        replica = self._replica() if readonly else None
+        if replica is not None:
+            try:
+                result = self._query(replica, query, params, fetch)
+                if result or not retry_empty:
+                    return result
+            except Exception:
+                record_replica_lag(replica, float('inf'))
+                self._drop(replica)
+        return self._primary(query, params, fetch)
+
+    async def write_lsn(self) -> Optional[str]:
+        """Позиция WAL primary после записей запроса; возвращается клиенту, только если есть реплики"""
+        if not self.wrote or not replica_urls():
+            return None
+        try:
+            return self._primary(PRIMARY_LSN_QUERY, (), 'one')['lsn']
+        except ServiceUnavailable:
+            return None
+
+    async def fetchone(self, query: str, params: Sequence[Any] = (), readonly: bool = False, retry_empty: bool = False) -> Optional[Dict[str, Any]]:
+        return self._read(query, params, 'one', readonly, retry_empty)
+
+    async def fetchall(self, query: str, params: Sequence[Any] = (), readonly: bool = False) -> List[Dict[str, Any]]:
+        return self._read(query, params, 'all', readonly)
+
+    async def execute(self, query: str, params: Sequence[Any] = ()) -> None:
+        self.wrote = True
+        self._primary(query, params, None)
+
+    def close(self):
+        for dsn in list(self.connections):
+            self._drop(dsn)
+
+async def _init_connection(conn: asyncpg.Connection):
+    """JSONB в виде dict, как в psycopg2; строки передаются как есть (уже сериализованный JSON)"""
+    await conn.set_type_codec(
+        'jsonb',
+        encoder=lambda value: value if isinstance(value, str) else json.dumps(value),
+        decoder=json.loads,
+        schema='pg_catalog'
     )
-    session = cur.fetchone()
-    
-    cur.close()
-    conn.close()
-    
-    return dict(session) if session else None
-
-def log_activity(user_id: int, user_email: str, action: str, entity_type: Optional[str], entity_id: Optional[str], old_values: Optional[Dict], new_values: Optional[Dict], ip_address: str, user_agent: str):
+
+async def get_pool(dsn: Optional[str] = None) -> asyncpg.Pool:
+    """Ленивое создание пула соединений asyncpg (один на процесс для primary и каждой реплики)"""
+    dsn = dsn or DATABASE_URL
+    pool = _pools.get(dsn)
+    if pool is None:
+        async with _pool_lock:
+            pool = _pools.get(dsn)
+            if pool is None:
+                pool = await asyncpg.create_pool(
+                    dsn, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                    timeout=DB_CONNECT_TIMEOUT, init=_init_connection
+                )
+                _pools[dsn] = pool
+    return pool
+
+class AsyncDatabase:
+    """Доступ к БД через пулы asyncpg: соединение берется из пула на время запроса"""
+
+    def __init__(self):
+        self.statement_timeout_ms = DB_STATEMENT_TIMEOUT_MS
+        self.min_lsn: Optional[str] = None
+        self.caught_up: Set[str] = set()
+        self.wrote = False
+
+    async def _query(self, dsn: Optional[str], query: str, params: Sequence[Any], fetch: Optional[str]) -> Any:
+        pool = await get_pool(dsn)
+        timeout = self.statement_timeout_ms / 1000
+        connection = await acquire_connection(pool)
+        try:
+            if fetch == 'one':
+                row = await connection.fetchrow(to_asyncpg_query(query), *params, timeout=timeout)
+                return dict(row) if row else None
+            if fetch == 'all':
+                return [dict(row) for row in await connection.fetch(to_asyncpg_query(query), *params, timeout=timeout)]
+            await connection.execute(to_asyncpg_query(query), *params, timeout=timeout)
+            return None
+        finally:
+            await pool.release(connection)
+
+    async def _primary(self, query: str, params: Sequence[Any], fetch: Optional[str]) -> Any:
+        circuit_check()
+        try:
+            result = await self._query(DATABASE_URL, query, params, fetch)
+        except ASYNC_DB_FAILURES as e:
+            print(f"Database error: {e}")
+            raise ServiceUnavailable(circuit_record_failure()) from e
+        circuit_record_success()
+        return result
+
+    async def _replica(self) -> Optional[str]:
+        if self.wrote:
+            return None
+        replicas = replica_urls()
+        for dsn in random.sample(replicas, len(replicas)):
+            if replica_lag_expired(dsn):
+                try:
+                    record_replica_lag(dsn, float((await self._query(dsn, REPLICA_LAG_QUERY, (), 'one'))['lag']))
+                except Exception:
+                    record_replica_lag(dsn, float('inf'))
+            if replica_is_fresh(dsn) and await self._caught_up(dsn):
+                return dsn
+        return None
+
+    async def _caught_up(self, dsn: str) -> bool:
+        """Реплика уже воспроизвела последнюю запись клиента (X-Min-LSN)"""
+        if self.min_lsn is None or dsn in self.caught_up:
+            return True
+        try:
+            if (await self._query(dsn, REPLICA_CAUGHT_UP_QUERY, (self.min_lsn,), 'one'))['caught_up']:
+                self.caught_up.add(dsn)
+                return True
+        except Exception as e:
+            print(f"Replica LSN check failed: {e}")
+        return False
+
+    async def _read(self, query: str, params: Sequence[Any], fetch: str, readonly: bool, retry_empty: bool = False) -> Any:
+        replica = await self._replica() if readonly else None
+        if replica is not None:
+            try:
+                result = await self._query(replica, query, params, fetch)
+                if result or not retry_empty:
+                    return result
+            except ServiceUnavailable:
+                pass
+            except Exception:
+                record_replica_lag(replica, float('inf'))
+        return await self._primary(query, params, fetch)
+
+    async def write_lsn(self) -> Optional[str]:
+        """Позиция WAL primary после записей запроса; возвращается клиенту, только если есть реплики"""
+        if not self.wrote or not replica_urls():
+            return None
+        try:
+            return (await self._primary(PRIMARY_LSN_QUERY, (), 'one'))['lsn']
+        except ServiceUnavailable:
+            return None
+
+    async def fetchone(self, query: str, params: Sequence[Any] = (), readonly: bool = False, retry_empty: bool = False) -> Optional[Dict[str, Any]]:
+        return await self._read(query, params, 'one', readonly, retry_empty)
+
+    async def fetchall(self, query: str, params: Sequence[Any] = (), readonly: bool = False) -> List[Dict[str, Any]]:
+        return await self._read(query, params, 'all', readonly)
+
+    async def execute(self, query: str, params: Sequence[Any] = ()) -> None:
+        self.wrote = True
+        await self._primary(query, params, None)
+
+def select_fields(requested: Optional[str], allowed: Sequence[str]) -> List[str]:
+    """Колонки из параметра fields= (через запятую) в порядке allowed"""
+    if not requested:
+        return list(allowed)
+    names = {name.strip() for name in requested.split(',') if name.strip()}
+    unknown = names - set(allowed)
+    if unknown or not names:
+        raise ValueError(', '.join(sorted(unknown)))
+    return [name for name in allowed if name in names]
+
+async def count_rows(db, table: str, mode: str) -> Tuple[int, bool]:
+    """Общее число строк: оценка pg_class.reltuples для больших таблиц (с учетом партиций) или точный COUNT(*) с кешем"""
+    if mode != 'exact':
+        row = await db.fetchone(ESTIMATE_QUERY, (table, table), readonly=True)
+        estimate = int(row['estimate'])
+        if estimate >= APPROXIMATE_COUNT_THRESHOLD:
+            return estimate, True
+
+    cached = _exact_counts.get(table)
+    if cached and cached[0] > time.monotonic():
+        return cached[1], False
+    row = await db.fetchone(f"SELECT COUNT(*) AS total FROM {table}", readonly=True)
+    _exact_counts[table] = (time.monotonic() + EXACT_COUNT_CACHE_SECONDS, row['total'])
+    return row['total'], False
+
+async def verify_session(db, token: str) -> Optional[Dict[str, Any]]:
+    """Проверка сессии и получение данных пользователя (в primary, с SESSION_REPLICA_READS=1 — в реплике)"""
+    if not token:
+        return None
+
+    if SESSION_REPLICA_READS:
+        # Окно отзыва: выход из системы доходит до реплики не позже REPLICA_MAX_LAG_SECONDS.
+        # Сессия, которой еще нет на реплике (только что вошли), перепроверяется в primary
+        return await db.fetchone(REPLICA_SESSION_QUERY, (token, REPLICA_MAX_LAG_SECONDS), readonly=True, retry_empty=True)
+    return await db.fetchone(SESSION_QUERY, (token,))
+
+async def log_activity(db, user_id: int, user_email: str, action: str, entity_type: Optional[str], entity_id: Optional[str], old_values: Optional[Dict], new_values: Optional[Dict], ip_address: str, user_agent: str):
     """Логирование активности"""
-    conn = psycopg2.connect(DATABASE_URL)
-    cur = conn.cursor()
-    
-    cur.execute(
+    await db.execute(
         "INSERT INTO activity_logs (user_id, user_email, action, entity_type, entity_id, old_values, new_values, ip_address, user_agent) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
-        (user_id, user_email, action, entity_type, entity_id, 
+        (user_id, user_email, action, entity_type, entity_id,
          json.dumps(old_values) if old_values else None,
          json.dumps(new_values) if new_values else None,
          ip_address, user_agent)
     )
-    
-    conn.commit()
-    cur.close()
-    conn.close()
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+async def handle_request(event: Dict[str, Any], db) -> Dict[str, Any]:
+    """Обработка запроса, общая для синхронного и асинхронного handler"""
     method: str = event.get('httpMethod', 'GET')
-    
+
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, X-Min-LSN',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
-    
+
     token = event.get('headers', {}).get('x-auth-token', '')
-    user_session = verify_session(token)
-    
+    db.statement_timeout_ms = STATEMENT_TIMEOUTS_MS['verify_session']
+    user_session = await verify_session(db, token)
+
     if not user_session:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Требуется авторизация'})
-        }
-    
+        return json_response(401, {'error': 'Требуется авторизация'})
+
     ip_address = event.get('requestContext', {}).get('identity', {}).get('sourceIp', '')
     user_agent = event.get('headers', {}).get('user-agent', '')
-    
+
     if method == 'GET':
         query_params = event.get('queryStringParameters', {}) or {}
         action = query_params.get('action', 'list_users')
-        
+        db.statement_timeout_ms = STATEMENT_TIMEOUTS_MS.get(action, DB_STATEMENT_TIMEOUT_MS)
+
+        if action in ('list_users', 'activity_logs') and user_session['role'] != 'admin':
+            return json_response(403, {'error': 'Доступ запрещен'})
+
+        total_mode = query_params.get('total')
+        if total_mode not in (None, '1', 'exact'):
+            return json_response(400, {'error': 'Параметр total: 1 (оценка) или exact'})
+
+        try:
+            fields = select_fields(query_params.get('fields'), LOG_FIELDS if action == 'activity_logs' else USER_FIELDS)
+        except ValueError as e:
+            return json_response(400, {'error': f'Неизвестные поля: {e}'})
+
         try:
-            conn = psycopg2.connect(DATABASE_URL)
-            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            
             if action == 'list_users':
-                if user_session['role'] != 'admin':
-                    return {
-                        'statusCode': 403,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Доступ запрещен'})
-                    }
-                
-                cur.execute(
-                    "SELECT id, email, full_name, role, is_active, created_at, last_login FROM users ORDER BY created_at DESC"
+                users = await db.fetchall(
+                    f"SELECT {', '.join(fields)} FROM users ORDER BY created_at DESC",
+                    readonly=True
                 )
-                users = [dict(row) for row in cur.fetchall()]
-                
+
                 for user in users:
                     if user.get('created_at'):
                         user['created_at'] = user['created_at'].isoformat()
                     if user.get('last_login'):
                         user['last_login'] = user['last_login'].isoformat()
-                
-                cur.close()
-                conn.close()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'users': users})
-                }
-            
+
+                response = {'users': users}
+                if total_mode:
+                    response['total'], response['total_estimated'] = await count_rows(db, 'users', total_mode)
+
+                return json_response(200, response)
+
             elif action == 'activity_logs':
-                if user_session['role'] != 'admin':
-                    return {
-                        'statusCode': 403,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Доступ запрещен'})
-                    }
-                
                 limit = int(query_params.get('limit', 100))
                 offset = int(query_params.get('offset', 0))
-                
-                cur.execute(
-                    "SELECT id, user_id, user_email, action, entity_type, entity_id, old_values, new_values, ip_address, created_at FROM activity_logs ORDER BY created_at DESC LIMIT %s OFFSET %s",
-                    (limit, offset)
+
+                logs = await db.fetchall(
+                    "SELECT " + ', '.join(fields) + " FROM activity_logs ORDER BY created_at DESC LIMIT %s OFFSET %s",
+                    (limit, offset),
+                    readonly=True
                 )
-                logs = [dict(row) for row in cur.fetchall()]
-                
+
                 for log in logs:
                     if log.get('created_at'):
                         log['created_at'] = log['created_at'].isoformat()
-                
-                cur.close()
-                conn.close()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'logs': logs})
-                }
-            
-            cur.close()
-            conn.close()
-            
+
+                response = {'logs': logs}
+                if total_mode:
+                    response['total'], response['total_estimated'] = await count_rows(db, 'activity_logs', total_mode)
+
+                return json_response(200, response)
+
+        except ServiceUnavailable:
+            raise
         except Exception as e:
-            return {
-                'statusCode': 500,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': str(e)})
-            }
-    
+            print(f"Error: {e}")
+            return json_response(500, {'error': 'Внутренняя ошибка сервера'})
+
     elif method == 'POST':
         if user_session['role'] != 'admin':
-            return {
-                'statusCode': 403,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Доступ запрещен'})
-            }
-        
+            return json_response(403, {'error': 'Доступ запрещен'})
+
         try:
             body_data = json.loads(event.get('body', '{}'))
             action = body_data.get('action')
-            
-            conn = psycopg2.connect(DATABASE_URL)
-            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            
+            db.statement_timeout_ms = STATEMENT_TIMEOUTS_MS.get(action, DB_STATEMENT_TIMEOUT_MS)
+
             if action == 'create_user':
                 email = body_data.get('email', '').strip().lower()
                 password = body_data.get('password', '')
                 full_name = body_data.get('full_name', '')
                 role = body_data.get('role', 'user')
-                
+
                 if not email or not password:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Email и пароль обязательны'})
-                    }
-                
+                    return json_response(400, {'error': 'Email и пароль обязательны'})
+
                 password_hash = hash_password(password)
-                
-                cur.execute(
+
+                new_user = await db.fetchone(
                     "INSERT INTO users (email, password_hash, full_name, role) VALUES (%s, %s, %s, %s) RETURNING id",
                     (email, password_hash, full_name, role)
                 )
-                new_user_id = cur.fetchone()['id']
-                conn.commit()
-                
-                log_activity(
+                new_user_id = new_user['id']
+
+                await log_activity(
+                    db,
                     user_session['user_id'],
                     user_session['email'],
                     'user_created',
@@ -205,84 +640,59 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     ip_address,
                     user_agent
                 )
-                
-                cur.close()
-                conn.close()
-                
-                return {
-                    'statusCode': 201,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'id': new_user_id, 'message': 'Пользователь создан'})
-                }
-            
+
+                return json_response(201, {'id': new_user_id, 'message': 'Пользователь создан'})
+
             elif action == 'update_user':
                 user_id = body_data.get('user_id')
-                
+
                 if not user_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'ID пользователя обязателен'})
-                    }
-                
-                cur.execute("SELECT email, full_name, role, is_active FROM users WHERE id = %s", (user_id,))
-                old_user = cur.fetchone()
-                
+                    return json_response(400, {'error': 'ID пользователя обязателен'})
+
+                user_id = int(user_id)
+                old_user = await db.fetchone("SELECT email, full_name, role, is_active FROM users WHERE id = %s", (user_id,))
+
                 if not old_user:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Пользователь не найден'})
-                    }
-                
+                    return json_response(404, {'error': 'Пользователь не найден'})
+
                 full_name = body_data.get('full_name', old_user['full_name'])
                 role = body_data.get('role', old_user['role'])
                 is_active = body_data.get('is_active', old_user['is_active'])
-                
-                cur.execute(
+
+                await db.execute(
                     "UPDATE users SET full_name = %s, role = %s, is_active = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
                     (full_name, role, is_active, user_id)
                 )
-                conn.commit()
-                
-                log_activity(
+
+                await log_activity(
+                    db,
                     user_session['user_id'],
                     user_session['email'],
                     'user_updated',
                     'user',
                     str(user_id),
-                    dict(old_user),
+                    old_user,
                     {'full_name': full_name, 'role': role, 'is_active': is_active},
                     ip_address,
                     user_agent
                 )
-                
-                cur.close()
-                conn.close()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'message': 'Пользователь обновлен'})
-                }
-            
+
+                return json_response(200, {'message': 'Пользователь обновлен'})
+
             elif action == 'change_password':
                 user_id = body_data.get('user_id')
                 new_password = body_data.get('new_password', '')
-                
+
                 if not user_id or not new_password:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'ID пользователя и новый пароль обязательны'})
-                    }
-                
+                    return json_response(400, {'error': 'ID пользователя и новый пароль обязательны'})
+
+                user_id = int(user_id)
                 password_hash = hash_password(new_password)
-                
-                cur.execute("UPDATE users SET password_hash = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s", (password_hash, user_id))
-                conn.commit()
-                
-                log_activity(
+
+                await db.execute("UPDATE users SET password_hash = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s", (password_hash, user_id))
+
+                await log_activity(
+                    db,
                     user_session['user_id'],
                     user_session['email'],
                     'password_changed',
@@ -293,34 +703,43 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     ip_address,
                     user_agent
                 )
-                
-                cur.close()
-                conn.close()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'message': 'Пароль изменен'})
-                }
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Неизвестное действие'})
-            }
-            
+
+                return json_response(200, {'message': 'Пароль изменен'})
+
+            return json_response(400, {'error': 'Неизвестное действие'})
+
+        except ServiceUnavailable:
+            raise
         except Exception as e:
-            return {
-                'statusCode': 500,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': str(e)})
-            }
-    
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Метод не поддерживается'})
-    }
+            print(f"Error: {e}")
+            return json_response(500, {'error': 'Внутренняя ошибка сервера'})
+
+    return json_response(405, {'error': 'Метод не поддерживается'})
+
+async def handle_consistent_request(event: Dict[str, Any], db) -> Dict[str, Any]:
+    """Read-your-writes между экземплярами функции: клиент возвращает полученный X-Min-LSN в следующих запросах"""
+    db.min_lsn = request_min_lsn(event)
+    response = await handle_request(event, db)
+    lsn = await db.write_lsn()
+    if lsn:
+        response['headers'].update({'X-Min-LSN': lsn, 'Access-Control-Expose-Headers': 'X-Min-LSN'})
+    return response
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    db = SyncDatabase(DATABASE_URL)
+    try:
+        return compress_response(run_sync(handle_consistent_request(event, db)), event)
+    except ServiceUnavailable as e:
+        return unavailable_response(e.retry_after)
+    finally:
+        db.close()
+
+async def async_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    if not acquire_request_slot():
+        return unavailable_response(1)
+    try:
+        return compress_response(await handle_consistent_request(event, AsyncDatabase()), event)
+    except ServiceUnavailable as e:
+        return unavailable_response(e.retry_after)
+    finally:
+        release_request_slot()
@@ -0,0 +1,35 @@
+-- Таблица объектов проектов (камеры, опоры и т.д.)
+-- lat/lon и geohash заполняются функцией objects при записи из текстового поля coordinates
+CREATE TABLE project_objects (
+    id VARCHAR(100) PRIMARY KEY,
+    project_id VARCHAR(100) NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    region VARCHAR(255),
+    district VARCHAR(255),
+    location TEXT,
+    coordinates VARCHAR(255),
+    lat DOUBLE PRECISION CHECK (lat BETWEEN -90 AND 90),
+    lon DOUBLE PRECISION CHECK (lon BETWEEN -180 AND 180),
+    geohash VARCHAR(12) COLLATE "C",
+    data JSONB NOT NULL DEFAULT '{}'::jsonb,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Индексы для оптимизации
+CREATE INDEX idx_project_objects_project_id ON project_objects(project_id);
+-- Пространственный индекс без PostGIS: диапазоны префиксов geohash (байтовый порядок за счет COLLATE "C")
+CREATE INDEX idx_project_objects_geohash ON project_objects(geohash) WHERE geohash IS NOT NULL;
+
+-- Если PostGIS доступен: geography-колонка и GiST индекс для радиусных запросов и поиска ближайших
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'postgis') THEN
+        CREATE EXTENSION IF NOT EXISTS postgis;
+        EXECUTE 'ALTER TABLE project_objects ADD COLUMN geog geography(Point, 4326) GENERATED ALWAYS AS (CASE WHEN lat IS NOT NULL AND lon IS NOT NULL THEN ST_SetSRID(ST_MakePoint(lon, lat), 4326)::geography END) STORED';
+        EXECUTE 'CREATE INDEX idx_project_objects_geog ON project_objects USING GIST (geog)';
+    END IF;
+EXCEPTION WHEN insufficient_privilege THEN
+    RAISE NOTICE 'PostGIS недоступен, используется индекс geohash';
+END
+$$;
@@ -0,0 +1,82 @@
+-- Перевод activity_logs на помесячные партиции по created_at
+ALTER TABLE activity_logs RENAME TO activity_logs_unpartitioned;
+ALTER SEQUENCE activity_logs_id_seq OWNED BY NONE;
+
+CREATE TABLE activity_logs (
+    id INTEGER NOT NULL DEFAULT nextval('activity_logs_id_seq'),
+    user_id INTEGER REFERENCES users(id),
+    user_email VARCHAR(255),
+    action VARCHAR(100) NOT NULL,
+    entity_type VARCHAR(100),
+    entity_id VARCHAR(100),
+    old_values JSONB,
+    new_values JSONB,
+    ip_address VARCHAR(45),
+    user_agent TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+ALTER SEQUENCE activity_logs_id_seq OWNED BY activity_logs.id;
+
+-- Страховочная партиция: запись не падает, если партиция месяца еще не создана
+CREATE TABLE activity_logs_default PARTITION OF activity_logs DEFAULT;
+
+-- Создание партиций activity_logs_YYYY_MM на months_ahead месяцев вперед от from_month.
+-- Строки, попавшие в activity_logs_default, переносятся в новую партицию.
+CREATE OR REPLACE FUNCTION create_activity_logs_partitions(
+    months_ahead INTEGER DEFAULT 3,
+    from_month DATE DEFAULT date_trunc('month', CURRENT_DATE)::date
+) RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE;
+    month_end DATE;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    FOR i IN 0..months_ahead LOOP
+        month_start := (date_trunc('month', from_month) + make_interval(months => i))::date;
+        month_end := (month_start + INTERVAL '1 month')::date;
+        partition_name := format('activity_logs_%s', to_char(month_start, 'YYYY_MM'));
+
+        IF to_regclass(partition_name) IS NULL THEN
+            LOCK TABLE activity_logs_default IN SHARE ROW EXCLUSIVE MODE;
+            EXECUTE format('CREATE TABLE %I (LIKE activity_logs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name);
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM activity_logs_default WHERE created_at >= %L AND created_at < %L RETURNING *) INSERT INTO %I SELECT * FROM moved',
+                month_start, month_end, partition_name
+            );
+            EXECUTE format(
+                'ALTER TABLE activity_logs ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, month_end
+            );
+            created := created + 1;
+        END IF;
+    END LOOP;
+
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Партиции для существующих данных и на 3 месяца вперед
+SELECT create_activity_logs_partitions(
+    ((EXTRACT(YEAR FROM CURRENT_DATE) - EXTRACT(YEAR FROM first_month)) * 12
+        + EXTRACT(MONTH FROM CURRENT_DATE) - EXTRACT(MONTH FROM first_month))::int + 3,
+    first_month
+)
+FROM (
+    SELECT COALESCE(date_trunc('month', MIN(created_at)), date_trunc('month', CURRENT_DATE))::date AS first_month
+    FROM activity_logs_unpartitioned
+) AS bounds;
+
+INSERT INTO activity_logs (id, user_id, user_email, action, entity_type, entity_id, old_values, new_values, ip_address, user_agent, created_at)
+SELECT id, user_id, user_email, action, entity_type, entity_id, old_values, new_values, ip_address, user_agent, COALESCE(created_at, CURRENT_TIMESTAMP)
+FROM activity_logs_unpartitioned;
+
+DROP TABLE activity_logs_unpartitioned;
+
+-- Индексы создаются на каждой партиции отдельно и остаются небольшими
+CREATE INDEX idx_activity_logs_user_id ON activity_logs(user_id);
+CREATE INDEX idx_activity_logs_created_at ON activity_logs(created_at);
+CREATE INDEX idx_activity_logs_action ON activity_logs(action);
+CREATE INDEX idx_activity_logs_entity ON activity_logs(entity_type, entity_id);
@@ -0,0 +1,259 @@
+"""
+Business: Обслуживание помесячных партиций activity_logs: создание будущих, архивация старых, импорт архива
+Args: maintain [--months-ahead N] [--retention-months N] [--archive-dir DIR] - создать партиции и архивировать старые
+      archive [--retention-months N] [--archive-dir DIR] - отсоединить, выгрузить в NDJSON.gz и удалить старые партиции
+      import FILE - восстановить партицию из архива и присоединить ее обратно (архивация ее пропускает)
+      release NAME - снять отметку восстановленной партиции, чтобы следующая архивация снова ее выгрузила
+Returns: Код возврата 0 при успехе; подключение через DATABASE_URL
+
+Старые строки из activity_logs_default (месяц без партиции на момент записи) перед архивацией переносятся
+в партиции своих месяцев и архивируются вместе с ними; если архив месяца уже есть, он дописывается.
+
+DDL с блокировкой activity_logs ждет ее не дольше ACTIVITY_LOGS_LOCK_TIMEOUT_MS и повторяется: иначе ожидание
+за долгой выгрузкой логов задержало бы все INSERT INTO activity_logs при входе. DETACH PARTITION CONCURRENTLY
+не подходит: он запрещен для таблиц с партицией по умолчанию.
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from datetime import date
+from typing import List, Optional, Tuple
+import psycopg2
+import psycopg2.errors
+import psycopg2.extras
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+ACTIVITY_LOGS_RETENTION_MONTHS = int(os.environ.get('ACTIVITY_LOGS_RETENTION_MONTHS', '12'))
+ACTIVITY_LOGS_MONTHS_AHEAD = int(os.environ.get('ACTIVITY_LOGS_MONTHS_AHEAD', '3'))
+ACTIVITY_LOGS_ARCHIVE_DIR = os.environ.get('ACTIVITY_LOGS_ARCHIVE_DIR', './activity_logs_archive')
+ACTIVITY_LOGS_LOCK_TIMEOUT_MS = int(os.environ.get('ACTIVITY_LOGS_LOCK_TIMEOUT_MS', '500'))
+ACTIVITY_LOGS_LOCK_RETRIES = int(os.environ.get('ACTIVITY_LOGS_LOCK_RETRIES', '10'))
+ACTIVITY_LOGS_LOCK_RETRY_SECONDS = float(os.environ.get('ACTIVITY_LOGS_LOCK_RETRY_SECONDS', '5'))
+IMPORT_BATCH_SIZE = 1000
+RESTORED_COMMENT = 'restored from archive'
+
+PARTITION_PATTERN = re.compile(r'^activity_logs_(\d{4})_(\d{2})$')
+ARCHIVE_PATTERN = re.compile(r'^(activity_logs_\d{4}_\d{2})\.ndjson\.gz$')
+
+def add_months(month: date, months: int) -> date:
+    """Сдвиг первого числа месяца на months месяцев"""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_bounds(name: str) -> Optional[Tuple[date, date]]:
+    """Границы месяца по имени партиции activity_logs_YYYY_MM"""
+    match = PARTITION_PATTERN.match(name)
+    if not match:
+        return None
+    month_start = date(int(match.group(1)), int(match.group(2)), 1)
+    return month_start, add_months(month_start, 1)
+
+def create_partitions(conn, months_ahead: int) -> int:
+    """Создание партиций на текущий и months_ahead следующих месяцев"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT create_activity_logs_partitions(%s)", (months_ahead,))
+        created = cur.fetchone()[0]
+    conn.commit()
+    return created
+
+def retention_cutoff(retention_months: int) -> date:
+    """Первый месяц, который еще хранится в БД"""
+    return add_months(date.today().replace(day=1), -retention_months)
+
+def run_with_lock_timeout(conn, query: str, params: Optional[Tuple] = None):
+    """Выполнение DDL в отдельной транзакции с lock_timeout; при занятой блокировке — повтор через паузу"""
+    for attempt in range(1, ACTIVITY_LOGS_LOCK_RETRIES + 1):
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SET LOCAL lock_timeout = %s", (ACTIVITY_LOGS_LOCK_TIMEOUT_MS,))
+                cur.execute(query, params)
+            conn.commit()
+            return
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            if attempt == ACTIVITY_LOGS_LOCK_RETRIES:
+                raise
+            print(f"Lock busy, retrying in {ACTIVITY_LOGS_LOCK_RETRY_SECONDS}s: {query}")
+            time.sleep(ACTIVITY_LOGS_LOCK_RETRY_SECONDS)
+
+def split_default_partition(conn, retention_months: int) -> int:
+    """Перенос строк старше срока хранения из activity_logs_default в партиции их месяцев"""
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT DISTINCT date_trunc('month', created_at)::date FROM activity_logs_default WHERE created_at < %s ORDER BY 1",
+            (retention_cutoff(retention_months),)
+        )
+        months = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    for month in months:
+        run_with_lock_timeout(conn, "SELECT create_activity_logs_partitions(0, %s)", (month,))
+    return len(months)
+
+def expired_partitions(conn, retention_months: int) -> List[str]:
+    """Партиции (в том числе уже отсоединенные) старше срока хранения, кроме восстановленных из архива"""
+    cutoff = retention_cutoff(retention_months)
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT tablename, obj_description(format('%I', tablename)::regclass, 'pg_class') FROM pg_tables "
+            "WHERE schemaname = current_schema() AND tablename LIKE 'activity\\_logs\\_%'"
+        )
+        names = [name for name, comment in cur.fetchall() if comment != RESTORED_COMMENT]
+    return sorted(name for name in names if (bounds := partition_bounds(name)) and bounds[1] <= cutoff)
+
+def detach_partition(conn, name: str):
+    """Отсоединение партиции от activity_logs, если она еще присоединена"""
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT 1 FROM pg_inherits WHERE inhparent = 'activity_logs'::regclass AND inhrelid = to_regclass(%s)",
+            (name,)
+        )
+        attached = cur.fetchone() is not None
+    conn.commit()
+    if attached:
+        run_with_lock_timeout(conn, f'ALTER TABLE activity_logs DETACH PARTITION "{name}"')
+
+def archived_max_id(path: str) -> int:
+    """Наибольший id в существующем архиве месяца (0, если архива нет)"""
+    max_id = 0
+    if os.path.exists(path):
+        with gzip.open(path, 'rt', encoding='utf-8') as archive:
+            for line in archive:
+                if line.strip():
+                    max_id = max(max_id, json.loads(line)['id'])
+    return max_id
+
+def dump_partition(conn, name: str, archive_dir: str) -> Tuple[str, int]:
+    """Выгрузка партиции в NDJSON.gz: запись во временный файл и атомарное переименование"""
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f'{name}.ndjson.gz')
+    tmp_path = f'{path}.tmp'
+    rows = 0
+
+    # Месяц уже архивировался: поздние строки из activity_logs_default (id больше архивных) дописываются
+    # новым gzip-членом, а строки, выгруженные до сбоя между выгрузкой и удалением, не повторяются
+    max_id = archived_max_id(path)
+    if max_id:
+        shutil.copyfile(path, tmp_path)
+    else:
+        open(tmp_path, 'wb').close()
+
+    with conn.cursor(name=f'dump_{name}') as cur, gzip.open(tmp_path, 'at', encoding='utf-8') as archive:
+        cur.itersize = 10000
+        cur.execute(f'SELECT row_to_json(t)::text FROM "{name}" AS t WHERE t.id > %s ORDER BY created_at, id', (max_id,))
+        for (line,) in cur:
+            archive.write(line)
+            archive.write('\n')
+            rows += 1
+    conn.commit()
+
+    with open(tmp_path, 'rb') as archive:
+        os.fsync(archive.fileno())
+    os.replace(tmp_path, path)
+    return path, rows
+
+def drop_partition(conn, name: str):
+    with conn.cursor() as cur:
+        cur.execute(f'DROP TABLE "{name}"')
+    conn.commit()
+
+def archive_partitions(conn, retention_months: int, archive_dir: str) -> int:
+    """Архивация партиций старше срока хранения: отсоединение, выгрузка, удаление"""
+    split = split_default_partition(conn, retention_months)
+    if split:
+        print(f"Moved old rows from activity_logs_default into {split} partitions")
+    archived = 0
+    for name in expired_partitions(conn, retention_months):
+        detach_partition(conn, name)
+        path, rows = dump_partition(conn, name, archive_dir)
+        drop_partition(conn, name)
+        print(f"Archived {name}: {rows} rows -> {path}")
+        archived += 1
+    return archived
+
+def import_archive(conn, path: str) -> int:
+    """Восстановление партиции из архива и присоединение к activity_logs"""
+    match = ARCHIVE_PATTERN.match(os.path.basename(path))
+    if not match:
+        raise ValueError(f'Ожидается файл activity_logs_YYYY_MM.ndjson.gz: {path}')
+    name = match.group(1)
+    month_start, month_end = partition_bounds(name)
+
+    rows = 0
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+        if cur.fetchone()[0]:
+            raise ValueError(f'Таблица {name} уже существует')
+
+        cur.execute(f'CREATE TABLE "{name}" (LIKE activity_logs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        insert = f'INSERT INTO "{name}" SELECT * FROM json_populate_record(NULL::activity_logs, %s::json)'
+        with gzip.open(path, 'rt', encoding='utf-8') as archive:
+            batch = []
+            for line in archive:
+                if not line.strip():
+                    continue
+                batch.append((line,))
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    psycopg2.extras.execute_batch(cur, insert, batch, page_size=IMPORT_BATCH_SIZE)
+                    rows += len(batch)
+                    batch = []
+            if batch:
+                psycopg2.extras.execute_batch(cur, insert, batch, page_size=IMPORT_BATCH_SIZE)
+                rows += len(batch)
+
+        cur.execute(
+            f'ALTER TABLE activity_logs ATTACH PARTITION "{name}" FOR VALUES FROM (%s) TO (%s)',
+            (month_start.isoformat(), month_end.isoformat())
+        )
+        cur.execute(f'COMMENT ON TABLE "{name}" IS %s', (RESTORED_COMMENT,))
+    conn.commit()
+    print(f"Imported {name}: {rows} rows from {path}")
+    return rows
+
+def release_partition(conn, name: str):
+    """Снятие отметки восстановленной партиции: следующая архивация выгрузит и удалит ее"""
+    if not partition_bounds(name):
+        raise ValueError(f'Ожидается имя activity_logs_YYYY_MM: {name}')
+    with conn.cursor() as cur:
+        cur.execute(f'COMMENT ON TABLE "{name}" IS NULL')
+    conn.commit()
+    print(f"Released {name}")
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Партиции activity_logs')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    maintain = commands.add_parser('maintain', help='создать будущие партиции и архивировать старые')
+    maintain.add_argument('--months-ahead', type=int, default=ACTIVITY_LOGS_MONTHS_AHEAD)
+    archive = commands.add_parser('archive', help='архивировать партиции старше срока хранения')
+    for command in (maintain, archive):
+        command.add_argument('--retention-months', type=int, default=ACTIVITY_LOGS_RETENTION_MONTHS)
+        command.add_argument('--archive-dir', default=ACTIVITY_LOGS_ARCHIVE_DIR)
+    restore = commands.add_parser('import', help='присоединить партицию из архива')
+    restore.add_argument('path')
+    release = commands.add_parser('release', help='вернуть восстановленную партицию под архивацию')
+    release.add_argument('name')
+
+    args = parser.parse_args(argv)
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        if args.command == 'maintain':
+            created = create_partitions(conn, args.months_ahead)
+            print(f"Created {created} partitions")
+            archive_partitions(conn, args.retention_months, args.archive_dir)
+        elif args.command == 'archive':
+            archive_partitions(conn, args.retention_months, args.archive_dir)
+        elif args.command == 'import':
+            import_archive(conn, args.path)
+        elif args.command == 'release':
+            release_partition(conn, args.name)
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+Business: Замер сжатия JSON-ответов функций: размер тела и время CPU compress_response на один ответ
+Args: [--function NAME] [--rows N ...] [--repeat N] [--gzip-levels L ...] [--seed N]
+Returns: Таблица в stdout: кодировка, уровень, строк, байт до и после (в base64), мс CPU на ответ
+
+Тело строится как ответ activity_logs из users: детерминированные строки журнала с old/new_values.
+Замеряется тот же путь, что в handler: json_response -> compress_response, включая base64.
+brotli и zstd замеряются, только если установлены модули brotli и zstandard.
+"""
+import argparse
+import importlib.util
+import pathlib
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+BACKEND_DIR = pathlib.Path(__file__).resolve().parents[1] / 'backend'
+ACTIONS = ('login_success', 'login_failed', 'user_updated', 'user_created', 'password_changed', 'logout')
+
+def load_function(name: str):
+    """Загрузка backend/<name>/index.py без развертывания"""
+    spec = importlib.util.spec_from_file_location(f'bench_{name}_index', BACKEND_DIR / name / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def activity_logs_payload(rows: int, seed: int) -> Dict[str, Any]:
+    """Ответ action=activity_logs из rows строк"""
+    rng = random.Random(seed)
+    started = datetime(2024, 5, 1, 9, 0)
+    logs = []
+    for i in range(rows):
+        action = rng.choice(ACTIONS)
+        user_id = rng.randint(1, 50)
+        changed = action == 'user_updated'
+        logs.append({
+            'id': rows - i,
+            'user_id': user_id,
+            'user_email': f'user{user_id}@example.com',
+            'action': action,
+            'entity_type': 'user' if changed else None,
+            'entity_id': str(rng.randint(1, 50)) if changed else None,
+            'old_values': {'role': 'user', 'full_name': f'Пользователь {user_id}'} if changed else None,
+            'new_values': {'role': rng.choice(('user', 'admin')), 'is_active': rng.random() > 0.1} if changed else None,
+            'ip_address': f'10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)}',
+            'created_at': (started - timedelta(seconds=i * rng.randint(5, 600))).isoformat()
+        })
+    return {'logs': logs, 'limit': rows}
+
+def measure(module, payload: Dict[str, Any], encoding: str, repeat: int) -> Dict[str, Any]:
+    """Средние CPU-время и размер ответа за repeat вызовов compress_response"""
+    event = {'httpMethod': 'GET', 'headers': {'accept-encoding': encoding}}
+    response = module.json_response(200, payload)
+    compressed = module.compress_response(response, event)
+    started = time.process_time()
+    for _ in range(repeat):
+        module.compress_response(response, event)
+    elapsed = time.process_time() - started
+    return {
+        'raw_bytes': len(response['body'].encode('utf-8')),
+        'body_bytes': len(compressed['body']),
+        'encoding': compressed['headers'].get('Content-Encoding', 'identity'),
+        'cpu_ms': elapsed / repeat * 1000,
+    }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Замер сжатия ответов')
+    parser.add_argument('--function', default='users', choices=('auth', 'email', 'users', 'objects'))
+    parser.add_argument('--rows', type=int, nargs='+', default=[10, 50, 500])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--gzip-levels', type=int, nargs='+', default=[1, 6, 9])
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    module = load_function(args.function)
+    print(f"{'encoding':<10}{'level':>6}{'rows':>7}{'raw B':>10}{'body B':>10}{'ratio':>8}{'cpu ms':>9}")
+    for rows in args.rows:
+        payload = activity_logs_payload(rows, args.seed)
+        runs = [('gzip', level) for level in args.gzip_levels]
+        runs += [(encoding, None) for encoding in module.COMPRESSORS if encoding != 'gzip']
+        for encoding, level in runs:
+            if level is not None:
+                module.RESPONSE_GZIP_LEVEL = level
+            result = measure(module, payload, encoding, args.repeat)
+            print(
+                f"{result['encoding']:<10}{level if level is not None else '-':>6}{rows:>7}{result['raw_bytes']:>10}"
+                f"{result['body_bytes']:>10}{result['body_bytes'] / result['raw_bytes']:>8.3f}{result['cpu_ms']:>9.3f}"
+            )
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,6 +14,17 @@ export interface AuthResponse {
   user: User;
 }
 
+// Позиция последней записи в БД: чтения после нее не уходят на отстающую реплику
+let minLsn: string | null = null;
+
+const rememberWriteLsn = (response: Response): void => {
+  minLsn = response.headers.get('X-Min-LSN') || minLsn;
+};
+
+const readHeaders = (token: string): Record<string, string> => (
+  minLsn ? { 'X-Auth-Token': token, 'X-Min-LSN': minLsn } : { 'X-Auth-Token': token }
+);
+
 export const sendVerificationCode = async (email: string, purpose: 'login' | 'password_reset' = 'login'): Promise<void> => {
   const response = await fetch(EMAIL_API, {
     method: 'POST',
@@ -90,7 +101,7 @@ export const setStoredToken = (token: string): void => {
 
 export const getUsers = async (token: string) => {
   const response = await fetch(`${USERS_API}?action=list_users`, {
-    headers: { 'X-Auth-Token': token },
+    headers: readHeaders(token),
   });
 
   if (!response.ok) {
@@ -119,6 +130,8 @@ export const createUser = async (token: string, userData: {
     }),
   });
 
+  rememberWriteLsn(response);
+
   if (!response.ok) {
     const error = await response.json();
     throw new Error(error.error || 'Ошибка создания пользователя');
@@ -145,6 +158,8 @@ export const updateUser = async (token: string, userId: number, userData: {
     }),
   });
 
+  rememberWriteLsn(response);
+
   if (!response.ok) {
     const error = await response.json();
     throw new Error(error.error || 'Ошибка обновления пользователя');
@@ -167,6 +182,8 @@ export const changePassword = async (token: string, userId: number, newPassword:
     }),
   });
 
+  rememberWriteLsn(response);
+
   if (!response.ok) {
     const error = await response.json();
     throw new Error(error.error || 'Ошибка изменения пароля');
@@ -177,7 +194,7 @@ export const changePassword = async (token: string, userId: number, newPassword:
 
 export const getActivityLogs = async (token: string, limit = 100, offset = 0) => {
   const response = await fetch(`${USERS_API}?action=activity_logs&limit=${limit}&offset=${offset}`, {
-    headers: { 'X-Auth-Token': token },
+    headers: readHeaders(token),
   });
 
   if (!response.ok) {
@@ -0,0 +1,194 @@
+"""
+Общие заглушки для тестов функций backend: одинаковые ответы БД для psycopg2 (handler) и asyncpg (async_handler)
+"""
+import asyncio
+import importlib.util
+import json
+import pathlib
+import re
+from datetime import datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Sequence, Tuple
+
+import asyncpg
+import pytest
+
+BACKEND_DIR = pathlib.Path(__file__).resolve().parents[2] / 'backend'
+PRIMARY_DSN = 'postgresql://primary/app'
+# Типы, которые asyncpg кодирует не из строки: параметр "$1::pg_lsn" ждет int и на '0/1000' падает с DataError
+ASYNCPG_NON_TEXT_PARAMS = {'pg_lsn': int}
+
+def load_function(name: str):
+    """Загрузка backend/<name>/index.py отдельным модулем: у каждого теста свое состояние пулов и автомата"""
+    spec = importlib.util.spec_from_file_location(f'backend_{name}_index', BACKEND_DIR / name / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class FakeBackend:
+    """Ответы по подстроке запроса (третий элемент, если есть, ограничивает ответ одним DSN) и журнал выполненных запросов (в нотации %s)"""
+
+    def __init__(self, responses: Sequence[Tuple[str, Any]]):
+        self.responses = responses
+        self.queries: List[Tuple[str, Tuple[Any, ...]]] = []
+        self.dsns: List[str] = []
+        self.set_timeouts: List[int] = []
+        self.query_timeouts: List[float] = []
+
+    def run(self, dsn: str, query: str, params: Sequence[Any]) -> List[Dict[str, Any]]:
+        self.queries.append((query, tuple(params)))
+        self.dsns.append(dsn)
+        for fragment, rows, *only_dsn in self.responses:
+            if fragment in query and only_dsn in ([], [dsn]):
+                return [dict(row) for row in (rows(tuple(params)) if callable(rows) else rows)]
+        return []
+
+class FakeCursor:
+    def __init__(self, backend: FakeBackend, dsn: str):
+        self.backend = backend
+        self.dsn = dsn
+        self.rows: List[Dict[str, Any]] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, query: str, params: Sequence[Any] = ()):
+        if query.startswith('SET statement_timeout'):
+            self.backend.set_timeouts.append(params[0])
+            return
+        self.rows = self.backend.run(self.dsn, query, params)
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+class FakeConnection:
+    """Соединение psycopg2"""
+
+    def __init__(self, backend: FakeBackend, dsn: str):
+        self.backend = backend
+        self.dsn = dsn
+        self.autocommit = False
+
+    def cursor(self, cursor_factory=None):
+        return FakeCursor(self.backend, self.dsn)
+
+    def close(self):
+        pass
+
+class FakeAsyncConnection:
+    """Соединение asyncpg: проверяет нумерацию $n и возвращает запрос в нотацию %s"""
+
+    def __init__(self, backend: FakeBackend, dsn: str):
+        self.backend = backend
+        self.dsn = dsn
+        self.codecs: Dict[str, Dict[str, Any]] = {}
+
+    def _run(self, query: str, args: Sequence[Any]) -> List[Dict[str, Any]]:
+        assert '%s' not in query
+        assert [int(n) for n in re.findall(r'\$(\d+)', query)] == list(range(1, len(args) + 1))
+        for n, typename in re.findall(r'\$(\d+)::(\w+)', query):
+            expected = ASYNCPG_NON_TEXT_PARAMS.get(typename)
+            if expected and not isinstance(args[int(n) - 1], expected):
+                raise asyncpg.exceptions.DataError(f'invalid input for query argument ${n}: expected {expected.__name__}')
+        return self.backend.run(self.dsn, re.sub(r'\$\d+', '%s', query), args)
+
+    async def fetchrow(self, query: str, *args, timeout=None):
+        self.backend.query_timeouts.append(timeout)
+        rows = self._run(query, args)
+        return rows[0] if rows else None
+
+    async def fetch(self, query: str, *args, timeout=None):
+        self.backend.query_timeouts.append(timeout)
+        return self._run(query, args)
+
+    async def execute(self, query: str, *args, timeout=None):
+        self.backend.query_timeouts.append(timeout)
+        self._run(query, args)
+        return 'OK'
+
+    async def set_type_codec(self, typename: str, **kwargs):
+        self.codecs[typename] = kwargs
+
+class FakePool(FakeAsyncConnection):
+    """Пул asyncpg из одного соединения"""
+
+    def __init__(self, backend: FakeBackend, dsn: str):
+        super().__init__(backend, dsn)
+        self.acquired = 0
+        self.acquire_timeouts: List[float] = []
+
+    async def acquire(self, timeout=None):
+        self.acquire_timeouts.append(timeout)
+        self.acquired += 1
+        return self
+
+    async def release(self, connection):
+        assert connection is self
+        self.acquired -= 1
+
+def normalize_queries(queries: Sequence[Tuple[str, Tuple[Any, ...]]]) -> List[Tuple[str, Tuple[Any, ...]]]:
+    """Время создания сессий и кодов зависит от момента вызова: сравнивается только тип"""
+    return [(query, tuple(datetime if isinstance(param, datetime) else param for param in params)) for query, params in queries]
+
+class HandlerRun(NamedTuple):
+    sync_response: Dict[str, Any]
+    async_response: Dict[str, Any]
+    sync_queries: List[Tuple[str, Tuple[Any, ...]]]
+    async_queries: List[Tuple[str, Tuple[Any, ...]]]
+    async_module: Any
+    sync_dsns: List[str]
+    async_dsns: List[str]
+
+@pytest.fixture
+def run_handlers(monkeypatch) -> Callable[..., HandlerRun]:
+    """Прогон события через handler и async_handler на одинаковых ответах БД (каждый в своем экземпляре модуля)"""
+
+    def run(name: str, event: Dict[str, Any], responses: Sequence[Tuple[str, Any]], setup: Callable = None) -> HandlerRun:
+        sync_module, async_module = load_function(name), load_function(name)
+        sync_backend = FakeBackend(responses)
+        async_backend = FakeBackend(responses)
+
+        async def create_pool(dsn, **kwargs):
+            pool = FakePool(async_backend, dsn)
+            if kwargs.get('init'):
+                await kwargs['init'](pool)
+            return pool
+
+        for module in (sync_module, async_module):
+            monkeypatch.setattr(module, 'DATABASE_URL', PRIMARY_DSN)
+            if setup:
+                setup(module)
+        monkeypatch.setattr(sync_module.psycopg2, 'connect', lambda dsn, **kwargs: FakeConnection(sync_backend, dsn))
+        monkeypatch.setattr(async_module.asyncpg, 'create_pool', create_pool)
+
+        return HandlerRun(
+            sync_module.handler(event, None),
+            asyncio.run(async_module.async_handler(event, None)),
+            normalize_queries(sync_backend.queries),
+            normalize_queries(async_backend.queries),
+            async_module,
+            sync_backend.dsns,
+            async_backend.dsns
+        )
+
+    return run
+
+def make_event(method: str, body: Any = None, query: Dict[str, str] = None, token: str = '', headers: Dict[str, str] = None) -> Dict[str, Any]:
+    """Событие в формате API gateway"""
+    event_headers = {'user-agent': 'pytest', **(headers or {})}
+    if token:
+        event_headers['x-auth-token'] = token
+    event = {
+        'httpMethod': method,
+        'headers': event_headers,
+        'queryStringParameters': query,
+        'requestContext': {'identity': {'sourceIp': '10.0.0.1'}}
+    }
+    if body is not None:
+        event['body'] = body if isinstance(body, str) else json.dumps(body)
+    return event
@@ -0,0 +1,87 @@
+import hashlib
+
+import pytest
+
+from conftest import PRIMARY_DSN, make_event
+
+SESSION = {'user_id': 1, 'email': 'admin@example.com', 'full_name': 'Admin', 'role': 'admin'}
+USERS = {
+    'admin@example.com': {'id': 1, 'email': 'admin@example.com', 'password_hash': hashlib.sha256(b'secret').hexdigest(),
+                          'full_name': 'Admin', 'role': 'admin', 'is_active': True},
+    'blocked@example.com': {'id': 3, 'email': 'blocked@example.com', 'password_hash': hashlib.sha256(b'secret').hexdigest(),
+                            'full_name': 'Blocked', 'role': 'user', 'is_active': False},
+}
+
+RESPONSES = [
+    ('FROM users WHERE email', lambda params: [USERS[params[0]]] if params[0] in USERS else []),
+    ('FROM sessions s', lambda params: [SESSION] if params[0] == 'valid-token' else []),
+]
+
+EVENTS = {
+    'options': make_event('OPTIONS'),
+    'get': make_event('GET'),
+    'login': make_event('POST', {'action': 'login', 'email': ' Admin@Example.com', 'password': 'secret'}),
+    'login wrong password': make_event('POST', {'action': 'login', 'email': 'admin@example.com', 'password': 'wrong'}),
+    'login inactive user': make_event('POST', {'action': 'login', 'email': 'blocked@example.com', 'password': 'secret'}),
+    'login unknown user': make_event('POST', {'action': 'login', 'email': 'nobody@example.com', 'password': 'secret'}),
+    'login without password': make_event('POST', {'action': 'login', 'email': 'admin@example.com'}),
+    'verify': make_event('POST', {'action': 'verify', 'token': 'valid-token'}),
+    'verify expired token': make_event('POST', {'action': 'verify', 'token': 'expired-token'}),
+    'verify without token': make_event('POST', {'action': 'verify'}),
+    'logout': make_event('POST', {'action': 'logout', 'token': 'valid-token'}),
+    'logout without token': make_event('POST', {'action': 'logout'}),
+    'unknown action': make_event('POST', {'action': 'register'}),
+    'invalid json': make_event('POST', 'not json'),
+}
+
+def fixed_token(module):
+    module.secrets = type('secrets', (), {'token_urlsafe': staticmethod(lambda size: 'new-token')})
+
+@pytest.mark.parametrize('event', EVENTS.values(), ids=EVENTS.keys())
+def test_sync_and_async_handlers_match(run_handlers, event):
+    run = run_handlers('auth', event, RESPONSES, setup=fixed_token)
+
+    assert run.sync_response == run.async_response
+    assert run.sync_queries == run.async_queries
+
+def test_login_writes_session_and_activity_through_both_drivers(run_handlers):
+    run = run_handlers('auth', EVENTS['login'], RESPONSES, setup=fixed_token)
+
+    assert run.async_response['statusCode'] == 200
+    assert [query.split(' (')[0] for query, _ in run.async_queries[1:]] == [
+        'UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = %s',
+        'INSERT INTO sessions',
+        'INSERT INTO activity_logs',
+    ]
+
+REPLICA_DSN = 'postgresql://replica/app'
+REPLICA_RESPONSES = RESPONSES + [('pg_last_xact_replay_timestamp', [{'lag': 0}])]
+
+def session_replica_reads(module):
+    module.SESSION_REPLICA_READS = True
+
+@pytest.mark.parametrize('on_replica, dsns', [
+    (True, [REPLICA_DSN]),
+    (False, [REPLICA_DSN, PRIMARY_DSN]),
+], ids=['found on replica', 'new session only on primary'])
+def test_verify_reads_replica_when_enabled(run_handlers, monkeypatch, on_replica, dsns):
+    monkeypatch.setenv('DATABASE_REPLICA_URL', REPLICA_DSN)
+    responses = REPLICA_RESPONSES if on_replica else [('FROM sessions s', [], REPLICA_DSN)] + REPLICA_RESPONSES
+    run = run_handlers('auth', EVENTS['verify'], responses, setup=session_replica_reads)
+
+    assert run.sync_response == run.async_response
+    assert run.async_response['statusCode'] == 200
+    for queries, query_dsns in ((run.sync_queries, run.sync_dsns), (run.async_queries, run.async_dsns)):
+        session_checks = [(query, params, dsn) for (query, params), dsn in zip(queries, query_dsns) if 'FROM sessions s' in query]
+        assert [dsn for _, _, dsn in session_checks] == dsns
+        for query, params, _ in session_checks:
+            # Окно отзыва ограничено прямо в запросе: отстающая реплика не вернет сессию
+            assert query.endswith('END <= %s::float8')
+            assert params == ('valid-token', run.async_module.REPLICA_MAX_LAG_SECONDS)
+
+def test_verify_stays_on_primary_by_default(run_handlers, monkeypatch):
+    monkeypatch.setenv('DATABASE_REPLICA_URL', REPLICA_DSN)
+    run = run_handlers('auth', EVENTS['verify'], REPLICA_RESPONSES)
+
+    assert run.async_response['statusCode'] == 200
+    assert run.sync_dsns == run.async_dsns == [PRIMARY_DSN]
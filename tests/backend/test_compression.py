@@ -0,0 +1,92 @@
+import base64
+import gzip
+import json
+
+import pytest
+
+from conftest import load_function, make_event
+
+FUNCTIONS = ['auth', 'email', 'users', 'objects']
+LARGE = {'rows': [{'id': i, 'action': 'login_success', 'ip_address': '10.0.0.1'} for i in range(100)]}
+
+@pytest.fixture(params=FUNCTIONS)
+def module(request, monkeypatch):
+    """Функция с предсказуемым набором сжатий: br (вместо brotli — gzip с пометкой) и gzip"""
+    module = load_function(request.param)
+    monkeypatch.setattr(module, 'COMPRESSORS', {'br': lambda data: b'br' + gzip.compress(data), 'gzip': module.COMPRESSORS['gzip']})
+    return module
+
+def compress(module, payload, accept_encoding=None, **response):
+    headers = {'accept-encoding': accept_encoding} if accept_encoding is not None else {}
+    return module.compress_response({**module.json_response(200, payload), **response}, make_event('GET', headers=headers))
+
+@pytest.mark.parametrize('accept_encoding, encoding', [
+    ('gzip', 'gzip'),
+    ('gzip, deflate, br', 'br'),
+    ('br;q=0, gzip', 'gzip'),
+    ('br;q=0.5, gzip;q=0.8', 'br'),
+    ('gzip;q=0', None),
+    ('GZIP', 'gzip'),
+    ('*', 'br'),
+    ('*;q=0', None),
+    ('br;q=0, *', 'gzip'),
+    ('gzip;q=0, *;q=1', 'br'),
+    ('identity', None),
+    ('deflate', None),
+    ('gzip;q=oops', None),
+    ('', None),
+])
+def test_negotiate_encoding(module, accept_encoding, encoding):
+    assert module.negotiate_encoding(accept_encoding) == encoding
+
+def test_large_body_is_gzipped_base64_and_round_trips(module):
+    response = compress(module, LARGE, 'gzip')
+
+    assert response['statusCode'] == 200
+    assert response['isBase64Encoded'] is True
+    assert response['headers']['Content-Encoding'] == 'gzip'
+    assert response['headers']['Vary'] == 'Accept-Encoding'
+    assert response['headers']['Content-Type'] == 'application/json'
+    assert json.loads(gzip.decompress(base64.b64decode(response['body']))) == LARGE
+
+def test_request_header_name_is_case_insensitive(module):
+    event = make_event('GET')
+    event['headers'] = {'Accept-Encoding': 'gzip'}
+
+    assert module.compress_response(module.json_response(200, LARGE), event)['headers']['Content-Encoding'] == 'gzip'
+
+def test_threshold_is_inclusive(module, monkeypatch):
+    raw_size = len(module.json_response(200, LARGE)['body'].encode('utf-8'))
+
+    monkeypatch.setattr(module, 'RESPONSE_COMPRESSION_MIN_BYTES', raw_size)
+    assert compress(module, LARGE, 'gzip')['headers']['Content-Encoding'] == 'gzip'
+
+    monkeypatch.setattr(module, 'RESPONSE_COMPRESSION_MIN_BYTES', raw_size + 1)
+    small = compress(module, LARGE, 'gzip')
+    assert small == module.json_response(200, LARGE)
+    assert 'Vary' not in small['headers']
+
+@pytest.mark.parametrize('accept_encoding', [None, 'identity', 'gzip;q=0'])
+def test_uncompressed_large_body_still_varies_on_accept_encoding(module, accept_encoding):
+    response = compress(module, LARGE, accept_encoding)
+
+    assert response['headers']['Vary'] == 'Accept-Encoding'
+    assert 'Content-Encoding' not in response['headers']
+    assert not response.get('isBase64Encoded')
+    assert json.loads(response['body']) == LARGE
+
+def test_incompressible_body_is_sent_as_is(module, monkeypatch):
+    monkeypatch.setattr(module, 'RESPONSE_COMPRESSION_MIN_BYTES', 16)
+    payload = {'token': base64.b64encode(bytes(range(256)) * 2).decode('ascii')[:60]}
+    response = compress(module, payload, 'gzip')
+
+    assert 'Content-Encoding' not in response['headers']
+    assert json.loads(response['body']) == payload
+
+def test_already_encoded_or_empty_bodies_are_untouched(module):
+    encoded = {'statusCode': 200, 'headers': {}, 'body': 'x' * 4096, 'isBase64Encoded': True}
+    empty = {'statusCode': 200, 'headers': {}, 'body': ''}
+    event = make_event('GET', headers={'accept-encoding': 'gzip'})
+
+    assert module.compress_response(encoded, event) is encoded
+    assert module.compress_response(empty, event) is empty
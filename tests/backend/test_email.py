@@ -0,0 +1,76 @@
+import pytest
+
+from conftest import make_event
+
+RESPONSES = [
+    ('FROM users WHERE email', lambda params: [{'id': 1}] if params == ('admin@example.com',) else []),
+    ('FROM verification_codes', lambda params: [{'id': 9}] if params[1] == '123456' else []),
+]
+
+EVENTS = {
+    'options': make_event('OPTIONS'),
+    'get': make_event('GET'),
+    'send code': make_event('POST', {'action': 'send_code', 'email': 'Admin@example.com'}),
+    'send code to unknown user': make_event('POST', {'action': 'send_code', 'email': 'nobody@example.com'}),
+    'send code without email': make_event('POST', {'action': 'send_code'}),
+    'verify code': make_event('POST', {'action': 'verify_code', 'email': 'admin@example.com', 'code': ' 123456 '}),
+    'verify wrong code': make_event('POST', {'action': 'verify_code', 'email': 'admin@example.com', 'code': '000000'}),
+    'unknown action': make_event('POST', {'action': 'resend'}),
+    'invalid json': make_event('POST', '{'),
+}
+
+def fixed_code(module):
+    module.generate_code = lambda: '123456'
+
+@pytest.mark.parametrize('event', EVENTS.values(), ids=EVENTS.keys())
+def test_sync_and_async_handlers_match(run_handlers, event):
+    run = run_handlers('email', event, RESPONSES, setup=fixed_code)
+
+    assert run.sync_response == run.async_response
+    assert run.sync_queries == run.async_queries
+
+@pytest.mark.parametrize('delivered', [True, False], ids=['delivered', 'smtp error'])
+def test_smtp_and_aiosmtplib_send_the_same_message(run_handlers, monkeypatch, delivered):
+    sent = []
+
+    class FakeSMTP:
+        def __init__(self, host, port):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            return False
+
+        def starttls(self):
+            pass
+
+        def login(self, user, password):
+            pass
+
+        def send_message(self, msg):
+            if not delivered:
+                raise OSError('connection refused')
+            sent.append(('smtplib', msg['To'], msg['Subject']))
+
+    async def fake_send(msg, **kwargs):
+        if not delivered:
+            raise OSError('connection refused')
+        sent.append(('aiosmtplib', msg['To'], msg['Subject']))
+
+    def configure(module):
+        fixed_code(module)
+        module.SMTP_HOST, module.SMTP_USER, module.SMTP_PASSWORD = 'smtp.example.com', 'robot@example.com', 'password'
+        monkeypatch.setattr(module.smtplib, 'SMTP', FakeSMTP)
+        monkeypatch.setattr(module.aiosmtplib, 'send', fake_send)
+
+    run = run_handlers('email', EVENTS['send code'], RESPONSES, setup=configure)
+
+    assert run.sync_response == run.async_response
+    assert run.async_response['statusCode'] == (200 if delivered else 500)
+    if delivered:
+        assert sent == [
+            ('smtplib', 'admin@example.com', 'Код подтверждения для входа'),
+            ('aiosmtplib', 'admin@example.com', 'Код подтверждения для входа'),
+        ]
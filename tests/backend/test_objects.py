@@ -0,0 +1,137 @@
+import json
+import math
+from datetime import datetime
+
+import pytest
+
+from conftest import load_function, make_event
+
+SESSION = {'user_id': 1, 'email': 'admin@example.com', 'full_name': 'Admin', 'role': 'admin'}
+OBJECT = {'id': 'cam-1', 'project_id': 'p1', 'name': 'Камера 1', 'region': 'Москва', 'district': None, 'location': None,
+          'coordinates': '55.7558, 37.6173', 'lat': 55.7558, 'lon': 37.6173, 'data': {'status': 'ok'},
+          'updated_at': datetime(2024, 5, 1, 12, 30)}
+
+RESPONSES = [
+    ('FROM sessions s', lambda params: [SESSION] if params == ('valid-token',) else []),
+    ('information_schema.columns', [{'enabled': False}]),
+    ('GROUP BY cell', [{'cell': 'ucfv0', 'count': 3, 'lat': 55.75, 'lon': 37.61, 'object_id': None}]),
+    ('FROM project_objects', [{**OBJECT, 'distance': 120.5}]),
+]
+
+BBOX = {'min_lat': '55.5', 'min_lon': '37.3', 'max_lat': '56', 'max_lon': '37.9'}
+
+EVENTS = {
+    'options': make_event('OPTIONS'),
+    'no token': make_event('GET', query={'action': 'bbox', **BBOX}),
+    'bbox': make_event('GET', query={'action': 'bbox', 'project_id': 'p1', **BBOX}, token='valid-token'),
+    'bbox out of range': make_event('GET', query={'action': 'bbox', **BBOX, 'max_lat': '91'}, token='valid-token'),
+    'clusters': make_event('GET', query={'action': 'clusters', 'zoom': '8', **BBOX}, token='valid-token'),
+    'clusters with bad zoom': make_event('GET', query={'action': 'clusters', 'zoom': 'near', **BBOX}, token='valid-token'),
+    'radius': make_event('GET', query={'action': 'radius', 'lat': '55.75', 'lon': '37.61', 'radius': '500'}, token='valid-token'),
+    'radius without distance': make_event('GET', query={'action': 'radius', 'lat': '55.75', 'lon': '37.61'}, token='valid-token'),
+    'nearest': make_event('GET', query={'action': 'nearest', 'lat': '55.75', 'lon': '37.61', 'limit': '1'}, token='valid-token'),
+    'bbox with negative limit': make_event('GET', query={'action': 'bbox', **BBOX, 'limit': '-1'}, token='valid-token'),
+    'nearest with zero limit': make_event('GET', query={'action': 'nearest', 'lat': '55.75', 'lon': '37.61', 'limit': '0'}, token='valid-token'),
+    'radius nan': make_event('GET', query={'action': 'radius', 'lat': '55.75', 'lon': '37.61', 'radius': 'nan'}, token='valid-token'),
+    'radius inf': make_event('GET', query={'action': 'radius', 'lat': '55.75', 'lon': '37.61', 'radius': 'inf'}, token='valid-token'),
+    'radius negative': make_event('GET', query={'action': 'radius', 'lat': '55.75', 'lon': '37.61', 'radius': '-5'}, token='valid-token'),
+    'radius larger than earth': make_event('GET', query={'action': 'radius', 'lat': '55.75', 'lon': '37.61', 'radius': '1e300'}, token='valid-token'),
+    'save object': make_event('POST', {'action': 'save_object', 'project_id': 'p1', 'object': {'id': 'cam-1', 'name': 'Камера 1', 'coordinates': '55.7558 N, 37.6173 E'}}, token='valid-token'),
+    'save object with bad coordinates': make_event('POST', {'action': 'save_object', 'project_id': 'p1', 'object': {'id': 'cam-2', 'name': 'Опора', 'coordinates': 'у моста'}}, token='valid-token'),
+    'save object without name': make_event('POST', {'action': 'save_object', 'project_id': 'p1', 'object': {'id': 'cam-3'}}, token='valid-token'),
+    'unknown action': make_event('POST', {'action': 'delete_object'}, token='valid-token'),
+}
+
+@pytest.mark.parametrize('event', EVENTS.values(), ids=EVENTS.keys())
+def test_sync_and_async_handlers_match(run_handlers, event):
+    run = run_handlers('objects', event, RESPONSES)
+
+    assert run.sync_response == run.async_response
+    assert run.sync_queries == run.async_queries
+
+def test_bad_zoom_is_rejected_before_querying(run_handlers):
+    run = run_handlers('objects', EVENTS['clusters with bad zoom'], RESPONSES)
+
+    assert run.async_response['statusCode'] == 400
+    assert not any('GROUP BY cell' in query for query, _ in run.async_queries)
+
+@pytest.mark.parametrize('name', ['bbox with negative limit', 'nearest with zero limit', 'radius nan', 'radius inf', 'radius negative', 'radius without distance'])
+def test_invalid_limit_or_radius_is_rejected_before_querying(run_handlers, name):
+    run = run_handlers('objects', EVENTS[name], RESPONSES)
+
+    assert run.sync_response['statusCode'] == run.async_response['statusCode'] == 400
+    assert not any('FROM project_objects' in query for query, _ in run.sync_queries + run.async_queries)
+
+def test_radius_is_capped_at_half_the_earth(run_handlers, objects):
+    run = run_handlers('objects', EVENTS['radius larger than earth'], RESPONSES)
+
+    assert run.async_response['statusCode'] == 200
+    radius = next(params for query, params in run.async_queries if 'FROM project_objects' in query)[-2]
+    assert radius == math.pi * objects.EARTH_RADIUS_M
+
+@pytest.mark.parametrize('action, query', [('bbox', BBOX), ('radius', {'lat': '55.75', 'lon': '37.61', 'radius': '50000'})])
+@pytest.mark.parametrize('limit, truncated', [('2', True), ('3', False), ('10', False)])
+def test_area_queries_report_truncation(run_handlers, action, query, limit, truncated):
+    objects = [{**OBJECT, 'id': f'cam-{i}', 'distance': 10.0 * i} for i in range(3)]
+    event = make_event('GET', query={'action': action, 'limit': limit, **query}, token='valid-token')
+    run = run_handlers('objects', event, [('FROM project_objects', objects)] + RESPONSES)
+    body = json.loads(run.async_response['body'])
+
+    assert run.sync_response == run.async_response
+    assert body['truncated'] is truncated
+    assert len(body['objects']) == min(int(limit), 3)
+    assert next(params for query, params in run.async_queries if 'FROM project_objects' in query)[-1] == int(limit) + 1
+
+@pytest.fixture
+def objects():
+    return load_function('objects')
+
+@pytest.mark.parametrize('value, expected', [
+    ('55.7558, 37.6173', (55.7558, 37.6173)),
+    ('55,7558 37,6173', (55.7558, 37.6173)),
+    ('55.7558° N, 37.6173° E', (55.7558, 37.6173)),
+    ('55.7558N 37.6173E', (55.7558, 37.6173)),
+    ('37.6173° E, 55.7558° N', (55.7558, 37.6173)),
+    ('N 55.75 E 37.61', (55.75, 37.61)),
+    ('E 37.61, N 55.75', (55.75, 37.61)),
+    ('S 33.86 E 151.21', (-33.86, 151.21)),
+    ('33.86 S, 70.66 W', (-33.86, -70.66)),
+    ('55.75 с.ш. 37.61 в.д.', (55.75, 37.61)),
+    ('-33.86, 151.21', (-33.86, 151.21)),
+], ids=str)
+def test_parse_coordinates(objects, value, expected):
+    assert objects.parse_coordinates(value) == expected
+
+@pytest.mark.parametrize('value', [
+    None,
+    '',
+    'у моста',
+    '55.7558',
+    '55.75 N 37.61',
+    'N 55.75 37.61',
+    '55.75 37.61 N E',
+    'N E 55.75 37.61',
+    'N 55.75 S 37.61',
+    '95.0, 37.61',
+    '55°45′N 37°37′E',
+], ids=str)
+def test_parse_coordinates_rejects_ambiguous_or_invalid(objects, value):
+    assert objects.parse_coordinates(value) is None
+
+@pytest.mark.parametrize('zoom', [0, 8, 14, 22])
+@pytest.mark.parametrize('bbox', [(55.5, 37.3, 56.0, 37.9), (-60.0, -170.0, 70.0, 170.0), (40.0, 170.0, 60.0, -170.0)], ids=['city', 'world', 'antimeridian'])
+def test_cluster_precision_keeps_cell_count_bounded(objects, zoom, bbox):
+    precision = objects.cluster_precision(zoom, *bbox)
+    lat_size, lon_size = objects.geohash_cell_size(precision)
+    min_lat, min_lon, max_lat, max_lon = bbox
+    lon_span = max_lon - min_lon if min_lon <= max_lon else 360 - (min_lon - max_lon)
+
+    assert 1 <= precision <= objects.GEOHASH_PRECISION
+    assert precision == 1 or (max_lat - min_lat) / lat_size * lon_span / lon_size <= objects.MAX_CLUSTER_CELLS
+    assert precision <= objects.cluster_precision(zoom, 55.75, 37.61, 55.75, 37.61)
+
+def test_cluster_precision_follows_zoom_for_small_areas(objects):
+    precisions = [objects.cluster_precision(zoom, 55.75, 37.61, 55.751, 37.611) for zoom in range(0, 23, 2)]
+
+    assert precisions == sorted(precisions)
+    assert precisions[0] == 1 and precisions[-1] == objects.GEOHASH_PRECISION
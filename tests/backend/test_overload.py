@@ -0,0 +1,158 @@
+import asyncio
+from typing import Any, Dict, List, NamedTuple
+
+import asyncpg
+import psycopg2
+import pytest
+
+from conftest import PRIMARY_DSN, FakeBackend, FakeConnection, FakePool, load_function, make_event
+
+EVENTS = {
+    'auth': make_event('POST', {'action': 'verify', 'token': 'valid-token'}),
+    'email': make_event('POST', {'action': 'verify_code', 'email': 'admin@example.com', 'code': '123456'}),
+    'users': make_event('GET', query={'action': 'list_users'}, token='valid-token'),
+    'objects': make_event('GET', query={'action': 'bbox', 'min_lat': '55', 'min_lon': '37', 'max_lat': '56', 'max_lon': '38'}, token='valid-token'),
+}
+
+SESSION = {'user_id': 1, 'email': 'admin@example.com', 'full_name': 'Admin', 'role': 'admin'}
+
+class ExhaustedPool(FakePool):
+    async def acquire(self, timeout=None):
+        raise asyncio.TimeoutError()
+
+class Harness(NamedTuple):
+    module: Any
+    backend: FakeBackend
+    connects: List[Dict[str, Any]]
+
+def pools(module):
+    return list(module._pools.values()) if hasattr(module, '_pools') else [module._pool]
+
+@pytest.fixture
+def connect(monkeypatch):
+    """Модуль функции с заглушками psycopg2 и asyncpg; pool_class задает поведение пула, down — отказ БД"""
+
+    def setup(name, pool_class=FakePool, responses=(), down=None):
+        module = load_function(name)
+        backend = FakeBackend(responses)
+        connects = []
+
+        def sync_connect(dsn, **kwargs):
+            connects.append(kwargs)
+            if down and down['value']:
+                raise psycopg2.OperationalError('could not connect to server')
+            return FakeConnection(backend, dsn)
+
+        class Pool(pool_class):
+            def _run(self, query, args):
+                connects.append({})
+                if down and down['value']:
+                    raise asyncpg.exceptions.PostgresConnectionError('connection was closed')
+                return super()._run(query, args)
+
+        async def create_pool(dsn, **kwargs):
+            return Pool(backend, dsn)
+
+        monkeypatch.setattr(module, 'DATABASE_URL', PRIMARY_DSN)
+        monkeypatch.setattr(module.psycopg2, 'connect', sync_connect)
+        monkeypatch.setattr(module.asyncpg, 'create_pool', create_pool)
+        return Harness(module, backend, connects)
+
+    return setup
+
+@pytest.mark.parametrize('name', EVENTS)
+def test_connections_are_acquired_with_timeout_and_released(connect, name):
+    module = connect(name).module
+
+    response = asyncio.run(module.async_handler(EVENTS[name], None))
+
+    assert response['statusCode'] in (400, 401)
+    for pool in pools(module):
+        assert pool.acquired == 0
+        assert pool.acquire_timeouts and set(pool.acquire_timeouts) == {module.DB_POOL_ACQUIRE_TIMEOUT}
+
+@pytest.mark.parametrize('name', EVENTS)
+def test_pool_acquire_timeout_is_503_without_opening_circuit(connect, name):
+    module = connect(name, ExhaustedPool).module
+
+    for _ in range(module.CIRCUIT_FAILURE_THRESHOLD + 1):
+        response = asyncio.run(module.async_handler(EVENTS[name], None))
+        assert response['statusCode'] == 503
+        assert response['headers']['Retry-After'] == '1'
+
+    assert module._circuit['failures'] == 0
+    assert module._in_flight == 0
+
+@pytest.mark.parametrize('name', EVENTS)
+def test_only_async_handler_sheds_requests_beyond_in_flight_limit(connect, name):
+    module = connect(name).module
+    module._in_flight = module.MAX_IN_FLIGHT_REQUESTS
+
+    assert module.MAX_IN_FLIGHT_REQUESTS >= 100
+    assert asyncio.run(module.async_handler(EVENTS[name], None))['statusCode'] == 503
+    assert module.handler(EVENTS[name], None)['statusCode'] != 503
+
+@pytest.mark.parametrize('mode', ['sync', 'async'])
+@pytest.mark.parametrize('name', EVENTS)
+def test_circuit_opens_after_consecutive_failures_and_lets_one_trial_through(connect, name, mode):
+    down = {'value': True}
+    harness = connect(name, down=down)
+    module = harness.module
+
+    def call():
+        if mode == 'sync':
+            return module.handler(EVENTS[name], None)
+        return asyncio.run(module.async_handler(EVENTS[name], None))
+
+    for attempt in range(1, module.CIRCUIT_FAILURE_THRESHOLD + 1):
+        response = call()
+        assert response['statusCode'] == 503
+        assert len(harness.connects) == attempt
+    assert response['headers']['Retry-After'] == str(module.CIRCUIT_RESET_SECONDS)
+
+    # Разомкнутый автомат отвечает сразу, не обращаясь к БД
+    response = call()
+    assert response['statusCode'] == 503
+    assert 1 <= int(response['headers']['Retry-After']) <= module.CIRCUIT_RESET_SECONDS
+    assert len(harness.connects) == module.CIRCUIT_FAILURE_THRESHOLD
+
+    # После паузы проходит один пробный запрос; неудачный снова размыкает автомат на всю паузу
+    module._circuit['open_until'] -= module.CIRCUIT_RESET_SECONDS
+    response = call()
+    assert response['headers']['Retry-After'] == str(module.CIRCUIT_RESET_SECONDS)
+    assert len(harness.connects) == module.CIRCUIT_FAILURE_THRESHOLD + 1
+    assert call()['statusCode'] == 503
+    assert len(harness.connects) == module.CIRCUIT_FAILURE_THRESHOLD + 1
+
+    # Удачный пробный запрос замыкает автомат
+    module._circuit['open_until'] -= module.CIRCUIT_RESET_SECONDS
+    down['value'] = False
+    assert call()['statusCode'] != 503
+    assert module._circuit['failures'] == 0
+
+TIMEOUT_CASES = {
+    'auth verify': ('auth', EVENTS['auth'], None, 'verify'),
+    'auth login': ('auth', make_event('POST', {'action': 'login', 'email': 'admin@example.com', 'password': 'secret'}), None, 'login'),
+    'email verify_code': ('email', EVENTS['email'], None, 'verify_code'),
+    'users list_users': ('users', EVENTS['users'], 'verify_session', 'list_users'),
+    'users activity_logs': ('users', make_event('GET', query={'action': 'activity_logs'}, token='valid-token'), 'verify_session', 'activity_logs'),
+    'objects bbox': ('objects', EVENTS['objects'], 'verify_session', 'bbox'),
+}
+
+@pytest.mark.parametrize('name, event, session_action, action', TIMEOUT_CASES.values(), ids=TIMEOUT_CASES.keys())
+def test_each_action_runs_with_its_statement_timeout(connect, name, event, session_action, action):
+    responses = [('FROM sessions s', [SESSION])]
+    sync = connect(name, responses=responses)
+    sync.module.handler(event, None)
+    async_run = connect(name, responses=responses)
+    asyncio.run(async_run.module.async_handler(event, None))
+
+    timeouts = sync.module.STATEMENT_TIMEOUTS_MS
+    expected = [timeouts[session_action]] if session_action else []
+    expected.append(timeouts[action])
+
+    # psycopg2: первый таймаут задается при подключении, смена действия — через SET statement_timeout
+    assert sync.connects[0]['options'] == f'-c statement_timeout={expected[0]}'
+    assert sync.backend.set_timeouts == expected[1:]
+    # asyncpg: таймаут передается в каждый запрос
+    assert list(dict.fromkeys(async_run.backend.query_timeouts)) == [ms / 1000 for ms in expected]
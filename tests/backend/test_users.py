@@ -0,0 +1,251 @@
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+
+from conftest import PRIMARY_DSN, load_function, make_event
+
+ADMIN = {'user_id': 1, 'email': 'admin@example.com', 'full_name': 'Admin', 'role': 'admin'}
+VIEWER = {'user_id': 2, 'email': 'viewer@example.com', 'full_name': 'Viewer', 'role': 'user'}
+SESSIONS = {'admin-token': ADMIN, 'viewer-token': VIEWER}
+CREATED_AT = datetime(2024, 5, 1, 12, 30)
+
+RESPONSES = [
+    ('FROM sessions s', lambda params: [SESSIONS[params[0]]] if params[0] in SESSIONS else []),
+    ('FROM users ORDER BY', lambda params: [
+        {'id': i, 'email': f'user{i}@example.com', 'full_name': f'Пользователь {i}', 'role': 'user',
+         'is_active': True, 'created_at': CREATED_AT, 'last_login': None}
+        for i in range(1, 40)
+    ]),
+    ('FROM activity_logs ORDER BY', [
+        {'id': 10, 'user_id': 1, 'user_email': 'admin@example.com', 'action': 'user_updated', 'entity_type': 'user',
+         'entity_id': '5', 'old_values': {'role': 'user'}, 'new_values': {'role': 'admin'}, 'ip_address': '10.0.0.1',
+         'created_at': CREATED_AT}
+    ]),
+    ('FROM pg_class', [{'estimate': 25}]),
+    ('COUNT(*)', [{'total': 39}]),
+    ('INSERT INTO users', [{'id': 7}]),
+    ('FROM users WHERE id', lambda params: [{'email': 'user5@example.com', 'full_name': 'Old', 'role': 'user', 'is_active': True}] if params == (5,) else []),
+]
+
+EVENTS = {
+    'options': make_event('OPTIONS'),
+    'no token': make_event('GET', query={'action': 'list_users'}),
+    'unknown token': make_event('GET', query={'action': 'list_users'}, token='expired'),
+    'list users': make_event('GET', query={'action': 'list_users'}, token='admin-token'),
+    'list users gzip': make_event('GET', query={'action': 'list_users'}, token='admin-token', headers={'accept-encoding': 'gzip'}),
+    'list users fields and total': make_event('GET', query={'action': 'list_users', 'fields': 'id,email', 'total': 'exact'}, token='admin-token'),
+    'list users unknown field': make_event('GET', query={'action': 'list_users', 'fields': 'password_hash'}, token='admin-token'),
+    'list users as viewer': make_event('GET', query={'action': 'list_users'}, token='viewer-token'),
+    'list users as viewer with unknown field': make_event('GET', query={'action': 'list_users', 'fields': 'password_hash'}, token='viewer-token'),
+    'logs as viewer with bad total': make_event('GET', query={'action': 'activity_logs', 'total': 'yes'}, token='viewer-token'),
+    'list users with bad total': make_event('GET', query={'action': 'list_users', 'total': 'true'}, token='admin-token'),
+    'list users with total 0': make_event('GET', query={'action': 'list_users', 'total': '0'}, token='admin-token'),
+    'activity logs': make_event('GET', query={'action': 'activity_logs', 'limit': '5', 'total': '1'}, token='admin-token'),
+    'activity logs bad limit': make_event('GET', query={'action': 'activity_logs', 'limit': 'x'}, token='admin-token'),
+    'create user': make_event('POST', {'action': 'create_user', 'email': ' New@Example.com ', 'password': 'secret', 'full_name': 'New'}, token='admin-token'),
+    'create user without password': make_event('POST', {'action': 'create_user', 'email': 'new@example.com'}, token='admin-token'),
+    'update user with string id': make_event('POST', {'action': 'update_user', 'user_id': '5', 'role': 'admin'}, token='admin-token'),
+    'update missing user': make_event('POST', {'action': 'update_user', 'user_id': 6}, token='admin-token'),
+    'change password': make_event('POST', {'action': 'change_password', 'user_id': '5', 'new_password': 'another'}, token='admin-token'),
+    'post as viewer': make_event('POST', {'action': 'create_user'}, token='viewer-token'),
+    'unknown action': make_event('POST', {'action': 'drop_users'}, token='admin-token'),
+    'invalid json': make_event('POST', '{', token='admin-token'),
+    'put': make_event('PUT', {}, token='admin-token'),
+}
+
+@pytest.fixture
+def users():
+    return load_function('users')
+
+@pytest.mark.parametrize('event', EVENTS.values(), ids=EVENTS.keys())
+def test_sync_and_async_handlers_match(run_handlers, event):
+    run = run_handlers('users', event, RESPONSES)
+
+    assert run.sync_response == run.async_response
+    assert run.sync_queries == run.async_queries
+
+@pytest.mark.parametrize('name, status', [
+    ('list users as viewer with unknown field', 403),
+    ('logs as viewer with bad total', 403),
+    ('list users unknown field', 400),
+    ('list users with bad total', 400),
+    ('list users with total 0', 400),
+    ('list users fields and total', 200),
+    ('activity logs', 200),
+])
+def test_listing_checks_role_before_validating_parameters(run_handlers, name, status):
+    run = run_handlers('users', EVENTS[name], RESPONSES)
+
+    assert run.sync_response['statusCode'] == run.async_response['statusCode'] == status
+    if status != 200:
+        assert [query for query, _ in run.async_queries] == [query for query, _ in run.async_queries if 'FROM sessions s' in query]
+
+def test_total_modes(run_handlers):
+    exact_run = run_handlers('users', EVENTS['list users fields and total'], RESPONSES)
+    exact = json.loads(exact_run.async_response['body'])
+    small_run = run_handlers('users', EVENTS['activity logs'], RESPONSES)
+    small = json.loads(small_run.async_response['body'])
+    plain = json.loads(run_handlers('users', EVENTS['list users'], RESPONSES).async_response['body'])
+
+    assert (exact['total'], exact['total_estimated']) == (39, False)
+    assert not any('FROM pg_class' in query for query, _ in exact_run.async_queries)
+    # Оценка ниже APPROXIMATE_COUNT_THRESHOLD: точный подсчет
+    assert (small['total'], small['total_estimated']) == (39, False)
+    assert [query for query, _ in small_run.async_queries if 'FROM pg_class' in query or 'COUNT(*)' in query] == [
+        small_run.async_module.ESTIMATE_QUERY, 'SELECT COUNT(*) AS total FROM activity_logs'
+    ]
+    assert 'total' not in plain
+    assert "SELECT id, email FROM users ORDER BY created_at DESC" in [query for query, _ in exact_run.async_queries]
+
+def test_large_table_total_is_estimated_without_counting(run_handlers, users):
+    estimate = users.APPROXIMATE_COUNT_THRESHOLD + 500
+    run = run_handlers('users', EVENTS['activity logs'], [('FROM pg_class', [{'estimate': estimate}])] + RESPONSES)
+    body = json.loads(run.async_response['body'])
+
+    assert run.sync_response == run.async_response
+    assert (body['total'], body['total_estimated']) == (estimate, True)
+    assert ('activity_logs', 'activity_logs') in [params for query, params in run.async_queries if 'FROM pg_class' in query]
+    assert not any('COUNT(*)' in query for query, _ in run.sync_queries + run.async_queries)
+
+    exact = run_handlers('users', make_event('GET', query={'action': 'activity_logs', 'total': 'exact'}, token='admin-token'),
+                         [('FROM pg_class', [{'estimate': estimate}])] + RESPONSES)
+    assert json.loads(exact.async_response['body'])['total_estimated'] is False
+
+class CountingDatabase:
+    """Адаптер БД для count_rows: оценка pg_class и COUNT(*) с журналом запросов"""
+
+    def __init__(self, estimate: int, total: int):
+        self.estimate = estimate
+        self.total = total
+        self.queries = []
+
+    async def fetchone(self, query, params=(), readonly=False):
+        self.queries.append(query)
+        return {'estimate': self.estimate} if 'FROM pg_class' in query else {'total': self.total}
+
+def test_exact_count_is_cached_per_table(users, monkeypatch):
+    clock = {'now': 1000.0}
+    monkeypatch.setattr(users.time, 'monotonic', lambda: clock['now'])
+    db = CountingDatabase(estimate=10, total=39)
+
+    assert users.run_sync(users.count_rows(db, 'users', 'exact')) == (39, False)
+    db.total = 40
+    assert users.run_sync(users.count_rows(db, 'users', 'exact')) == (39, False)
+    assert users.run_sync(users.count_rows(db, 'users', '1')) == (39, False)
+    assert [query for query in db.queries if 'COUNT(*)' in query] == ['SELECT COUNT(*) AS total FROM users']
+
+    assert users.run_sync(users.count_rows(db, 'activity_logs', 'exact')) == (40, False)
+    clock['now'] += users.EXACT_COUNT_CACHE_SECONDS + 1
+    assert users.run_sync(users.count_rows(db, 'users', 'exact')) == (40, False)
+    assert sum('COUNT(*)' in query for query in db.queries) == 3
+
+def test_update_user_coerces_id_for_both_drivers(run_handlers):
+    run = run_handlers('users', EVENTS['update user with string id'], RESPONSES)
+
+    assert run.sync_response['statusCode'] == run.async_response['statusCode'] == 200
+    update = next(params for query, params in run.async_queries if query.startswith('UPDATE users'))
+    assert update[-1] == 5 and isinstance(update[-1], int)
+
+def test_activity_log_values_pass_through_jsonb_codec(run_handlers):
+    run = run_handlers('users', EVENTS['update user with string id'], RESPONSES)
+    codec = next(iter(run.async_module._pools.values())).codecs['jsonb']
+    insert = next(params for query, params in run.async_queries if query.startswith('INSERT INTO activity_logs'))
+
+    assert codec['schema'] == 'pg_catalog'
+    assert codec['encoder'](insert[5]) == insert[5]
+    assert json.loads(codec['encoder'](insert[6])) == {'full_name': 'Old', 'role': 'admin', 'is_active': True}
+    assert codec['encoder']({'role': 'admin'}) == '{"role": "admin"}'
+    assert codec['decoder']('{"role": "admin"}') == {'role': 'admin'}
+
+def test_to_asyncpg_query_numbers_placeholders(users):
+    assert users.to_asyncpg_query("SELECT 1") == "SELECT 1"
+    assert users.to_asyncpg_query("UPDATE users SET role = %s WHERE id = %s") == "UPDATE users SET role = $1 WHERE id = $2"
+    assert users.to_asyncpg_query("%s%s") == "$1$2"
+
+def test_run_sync_returns_result_of_coroutine_that_never_suspends(users):
+    async def compute():
+        return 42
+
+    assert users.run_sync(compute()) == 42
+
+def test_run_sync_rejects_suspending_coroutine(users):
+    async def suspends():
+        await asyncio.sleep(0)
+
+    with pytest.raises(RuntimeError):
+        users.run_sync(suspends())
+
+REPLICA_DSN = 'postgresql://replica/app'
+REPLICA_RESPONSES = RESPONSES + [
+    ('pg_last_xact_replay_timestamp', [{'lag': 0}]),
+    ('pg_last_wal_replay_lsn() >=', lambda params: [{'caught_up': params == ('0/1000',)}]),
+    ('pg_current_wal_lsn', [{'lsn': '0/3000060'}]),
+]
+
+def query_dsn(run, fragment):
+    """Куда ушел запрос в синхронном и асинхронном прогоне"""
+    sync_dsn = next(dsn for dsn, (query, _) in zip(run.sync_dsns, run.sync_queries) if fragment in query)
+    async_dsn = next(dsn for dsn, (query, _) in zip(run.async_dsns, run.async_queries) if fragment in query)
+    assert sync_dsn == async_dsn
+    return sync_dsn
+
+@pytest.mark.parametrize('min_lsn, listing_dsn', [
+    (None, REPLICA_DSN),
+    ('0/1000', REPLICA_DSN),
+    ('0/9000000', PRIMARY_DSN),
+    ('not-an-lsn', REPLICA_DSN),
+], ids=['no header', 'replica caught up', 'replica behind', 'invalid header'])
+def test_session_is_verified_on_primary_and_listing_honours_min_lsn(run_handlers, monkeypatch, min_lsn, listing_dsn):
+    monkeypatch.setenv('DATABASE_REPLICA_URL', REPLICA_DSN)
+    headers = {'x-min-lsn': min_lsn} if min_lsn else {}
+    run = run_handlers('users', make_event('GET', query={'action': 'list_users'}, token='admin-token', headers=headers), REPLICA_RESPONSES)
+
+    assert run.sync_response == run.async_response
+    assert run.async_response['statusCode'] == 200
+    assert query_dsn(run, 'FROM sessions s') == PRIMARY_DSN
+    assert query_dsn(run, 'FROM users ORDER BY') == listing_dsn
+    assert 'X-Min-LSN' not in run.async_response['headers']
+
+def test_write_returns_min_lsn_only_when_replicas_are_configured(run_handlers, monkeypatch):
+    event = EVENTS['change password']
+    without_replicas = run_handlers('users', event, REPLICA_RESPONSES)
+    monkeypatch.setenv('DATABASE_REPLICA_URL', REPLICA_DSN)
+    with_replicas = run_handlers('users', event, REPLICA_RESPONSES)
+
+    assert 'X-Min-LSN' not in without_replicas.async_response['headers']
+    assert with_replicas.sync_response == with_replicas.async_response
+    assert with_replicas.async_response['headers']['X-Min-LSN'] == '0/3000060'
+    assert query_dsn(with_replicas, 'pg_current_wal_lsn') == PRIMARY_DSN
+
+def test_min_lsn_is_sent_as_text_and_check_failure_keeps_replica(run_handlers, monkeypatch):
+    monkeypatch.setenv('DATABASE_REPLICA_URL', REPLICA_DSN)
+    event = make_event('GET', query={'action': 'list_users'}, token='admin-token', headers={'x-min-lsn': '0/1000'})
+    run = run_handlers('users', event, REPLICA_RESPONSES)
+    check = [params for query, params in run.async_queries if 'pg_last_wal_replay_lsn() >=' in query]
+
+    assert check == [('0/1000',)]
+    assert '%s::text::pg_lsn' in next(query for query, _ in run.async_queries if 'pg_last_wal_replay_lsn() >=' in query)
+
+    def failing_check(params):
+        raise RuntimeError('replica went away')
+
+    failing = run_handlers('users', event, [('pg_last_wal_replay_lsn() >=', failing_check)] + REPLICA_RESPONSES)
+    assert failing.sync_response == failing.async_response
+    assert query_dsn(failing, 'FROM users ORDER BY') == PRIMARY_DSN
+    assert failing.async_module.replica_is_fresh(REPLICA_DSN)
+
+@pytest.mark.parametrize('name', ['users', 'objects'])
+def test_verify_session_reads_replica_when_enabled(run_handlers, monkeypatch, name):
+    monkeypatch.setenv('DATABASE_REPLICA_URL', REPLICA_DSN)
+    event = make_event('GET', query={'action': 'list_users'} if name == 'users' else {'action': 'nearest', 'lat': '55', 'lon': '37'}, token='admin-token')
+    enable = lambda module: monkeypatch.setattr(module, 'SESSION_REPLICA_READS', True)
+    found = run_handlers(name, event, REPLICA_RESPONSES, setup=enable)
+    missing = run_handlers(name, event, [('FROM sessions s', [], REPLICA_DSN)] + REPLICA_RESPONSES, setup=enable)
+
+    assert found.sync_response == found.async_response
+    assert found.async_response['statusCode'] == missing.async_response['statusCode'] == 200
+    assert query_dsn(found, 'FROM sessions s') == REPLICA_DSN
+    session_dsns = [dsn for dsn, (query, _) in zip(missing.async_dsns, missing.async_queries) if 'FROM sessions s' in query]
+    assert session_dsns == [REPLICA_DSN, PRIMARY_DSN]
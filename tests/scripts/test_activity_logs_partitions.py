@@ -0,0 +1,155 @@
+import gzip
+import importlib.util
+import json
+import pathlib
+from datetime import date
+
+import psycopg2.errors
+import pytest
+
+SCRIPT = pathlib.Path(__file__).resolve().parents[2] / 'scripts' / 'activity_logs_partitions.py'
+
+@pytest.fixture
+def partitions():
+    spec = importlib.util.spec_from_file_location('activity_logs_partitions', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+        self.itersize = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def mogrify(self, query, params):
+        return query.encode()
+
+    def execute(self, query, params=None):
+        query = query.decode() if isinstance(query, bytes) else query
+        self.conn.executed.append((query, params))
+        self.rows = self.conn.respond(query, params)
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+class FakeConnection:
+    def __init__(self, respond):
+        self.respond = respond
+        self.executed = []
+
+    def cursor(self, name=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.executed.append(('COMMIT', None))
+
+    def rollback(self):
+        self.executed.append(('ROLLBACK', None))
+
+def log_row(row_id, created_at='2023-01-15T10:00:00'):
+    return (json.dumps({'id': row_id, 'action': 'login_success', 'created_at': created_at}),)
+
+def read_archive(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as archive:
+        return [json.loads(line)['id'] for line in archive if line.strip()]
+
+def test_expired_partitions_skip_restored_and_current(partitions):
+    cutoff_month = partitions.add_months(date.today().replace(day=1), -12)
+    old = f'activity_logs_{partitions.add_months(cutoff_month, -1):%Y_%m}'
+    restored = f'activity_logs_{partitions.add_months(cutoff_month, -2):%Y_%m}'
+    current = f'activity_logs_{date.today():%Y_%m}'
+    conn = FakeConnection(lambda query, params: [
+        (old, None), (restored, partitions.RESTORED_COMMENT), (current, None), ('activity_logs_default', None)
+    ])
+
+    assert partitions.expired_partitions(conn, 12) == [old]
+
+def test_dump_appends_only_rows_newer_than_existing_archive(partitions, tmp_path):
+    table = {'rows': [log_row(1), log_row(2)]}
+
+    def respond(query, params):
+        assert 'WHERE t.id > %s' in query
+        return [row for row in table['rows'] if json.loads(row[0])['id'] > params[0]]
+
+    conn = FakeConnection(respond)
+    path, rows = partitions.dump_partition(conn, 'activity_logs_2023_01', str(tmp_path))
+    assert rows == 2 and read_archive(path) == [1, 2]
+
+    # Повторный запуск после сбоя до DROP: те же строки не дублируются
+    assert partitions.dump_partition(conn, 'activity_logs_2023_01', str(tmp_path))[1] == 0
+    assert read_archive(path) == [1, 2]
+
+    # Поздние строки месяца из activity_logs_default дописываются к архиву
+    table['rows'] = [log_row(7, '2023-01-20T08:00:00')]
+    assert partitions.dump_partition(conn, 'activity_logs_2023_01', str(tmp_path))[1] == 1
+    assert read_archive(path) == [1, 2, 7]
+    assert not (tmp_path / 'activity_logs_2023_01.ndjson.gz.tmp').exists()
+
+def test_archive_moves_old_default_rows_into_month_partitions_first(partitions, tmp_path):
+    conn = FakeConnection(lambda query, params: [(date(2020, 3, 1),), (date(2020, 5, 1),)] if 'activity_logs_default' in query else [])
+
+    partitions.archive_partitions(conn, 12, str(tmp_path))
+
+    created = [params for query, params in conn.executed if 'create_activity_logs_partitions' in query]
+    assert created == [(date(2020, 3, 1),), (date(2020, 5, 1),)]
+    assert conn.executed[0][1] == (partitions.retention_cutoff(12),)
+
+def test_import_marks_partition_and_release_clears_mark(partitions, tmp_path):
+    path = tmp_path / 'activity_logs_2023_01.ndjson.gz'
+    with gzip.open(path, 'wt', encoding='utf-8') as archive:
+        archive.write(log_row(1)[0] + '\n')
+    conn = FakeConnection(lambda query, params: [(False,)] if 'to_regclass' in query else [])
+
+    partitions.import_archive(conn, str(path))
+    partitions.release_partition(conn, 'activity_logs_2023_01')
+
+    comments = [(query, params) for query, params in conn.executed if query.startswith('COMMENT ON TABLE')]
+    assert comments == [
+        ('COMMENT ON TABLE "activity_logs_2023_01" IS %s', (partitions.RESTORED_COMMENT,)),
+        ('COMMENT ON TABLE "activity_logs_2023_01" IS NULL', None),
+    ]
+
+def test_detach_waits_for_lock_with_timeout_and_retries(partitions, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(partitions.time, 'sleep', sleeps.append)
+    busy = {'left': 2}
+
+    def respond(query, params):
+        if query.startswith('ALTER TABLE') and busy['left']:
+            busy['left'] -= 1
+            raise psycopg2.errors.LockNotAvailable()
+        return [(1,)]
+
+    conn = FakeConnection(respond)
+    partitions.detach_partition(conn, 'activity_logs_2023_01')
+
+    detach = ('ALTER TABLE activity_logs DETACH PARTITION "activity_logs_2023_01"', None)
+    lock_timeout = ('SET LOCAL lock_timeout = %s', (partitions.ACTIVITY_LOGS_LOCK_TIMEOUT_MS,))
+    assert conn.executed[2:] == [lock_timeout, detach, ('ROLLBACK', None)] * 2 + [lock_timeout, detach, ('COMMIT', None)]
+    assert sleeps == [partitions.ACTIVITY_LOGS_LOCK_RETRY_SECONDS] * 2
+
+def test_detach_gives_up_after_retries(partitions, monkeypatch):
+    monkeypatch.setattr(partitions.time, 'sleep', lambda seconds: None)
+
+    def respond(query, params):
+        if query.startswith('ALTER TABLE'):
+            raise psycopg2.errors.LockNotAvailable()
+        return [(1,)]
+
+    conn = FakeConnection(respond)
+    with pytest.raises(psycopg2.errors.LockNotAvailable):
+        partitions.detach_partition(conn, 'activity_logs_2023_01')
+    assert sum(query.startswith('ALTER TABLE') for query, _ in conn.executed) == partitions.ACTIVITY_LOGS_LOCK_RETRIES
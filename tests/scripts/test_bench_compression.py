@@ -0,0 +1,32 @@
+import importlib.util
+import pathlib
+
+import pytest
+
+SCRIPT = pathlib.Path(__file__).resolve().parents[2] / 'scripts' / 'bench_compression.py'
+
+@pytest.fixture
+def bench():
+    spec = importlib.util.spec_from_file_location('bench_compression', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def test_payload_is_deterministic(bench):
+    assert bench.activity_logs_payload(20, seed=3) == bench.activity_logs_payload(20, seed=3)
+    assert len(bench.activity_logs_payload(20, seed=3)['logs']) == 20
+
+def test_measure_reports_compressed_size_of_shipped_path(bench):
+    users = bench.load_function('users')
+    result = bench.measure(users, bench.activity_logs_payload(50, seed=1), 'gzip', repeat=2)
+
+    assert result['encoding'] == 'gzip'
+    assert result['body_bytes'] < result['raw_bytes']
+    assert result['cpu_ms'] >= 0
+
+def test_main_prints_a_row_per_run(bench, capsys):
+    assert bench.main(['--rows', '5', '40', '--repeat', '1', '--gzip-levels', '1', '9']) == 0
+
+    lines = capsys.readouterr().out.strip().splitlines()
+    assert lines[0].split()[:3] == ['encoding', 'level', 'rows']
+    assert len(lines) == 1 + 2 * (2 + len(bench.load_function('users').COMPRESSORS) - 1)